@@ -0,0 +1,97 @@
+"""
+Benchmark building and sending the Google Docs requests for a user, using the offline
+stand-in in `fake_google_docs.py` (no credentials or network access needed for synthetic
+users).
+
+Usage:
+    python benchmark_google_doc.py --entries 2000
+    python benchmark_google_doc.py --entries 2000 --entries-per-batch 100
+    python benchmark_google_doc.py --username bcunningham  # scrapes the user first
+"""
+import json
+import time
+import argparse
+from types import SimpleNamespace
+
+from trailjournals_scraping import EntryMetadata, Image, User
+from fake_google_docs import FakeDocsService
+import write_google_doc
+
+
+def synthetic_user(n_entries: int, entries_per_journal: int = 150, images_per_entry: int = 3) -> SimpleNamespace:
+    """A stand-in for `User` with realistic-looking entries."""
+    paragraph = "Walked through the rhododendron tunnels and up the ridge to the shelter. " * 6
+    journals = []
+    for i in range(0, n_entries, entries_per_journal):
+        entries = []
+        for j in range(i, min(i + entries_per_journal, n_entries)):
+            entries.append(SimpleNamespace(
+                title=f"Day {j + 1}",
+                date="Saturday, July 8th, 2023",
+                metadata=EntryMetadata(start="Gooch Mountain Shelter", destination="Neels Gap", miles="15.20", trip_miles=f"{j * 15}"),
+                text="\n\n".join([paragraph] * 5),
+                images=[Image(f"/images/{j}_{k}.jpg", caption="A view" if k % 2 == 0 else None) for k in range(images_per_entry)],
+            ))
+        journals.append(SimpleNamespace(title=f"Journal {len(journals) + 1}", entries=entries))
+    return SimpleNamespace(username="synthetic", journals=journals)
+
+
+def run_benchmark(user, entries_per_batch: int = None) -> dict:
+    n_entries = sum([len(x.entries) for x in user.journals])
+
+    start = time.perf_counter()
+    batches = list(write_google_doc.iter_request_batches(user, entries_per_batch=entries_per_batch))
+    build_seconds = time.perf_counter() - start
+    n_requests = sum([len(x) for x in batches])
+    payload_bytes = sum([len(json.dumps({"requests": x}).encode("utf-8")) for x in batches])
+
+    # the fake service and the pacing run on a simulated clock, so waiting for the write quota takes no time
+    now = [0.0]
+
+    def sleep(seconds: float):
+        now[0] += seconds
+
+    service = FakeDocsService(clock=lambda: now[0])
+    start = time.perf_counter()
+    write_google_doc.write_to_google_doc(
+        user,
+        "benchmark",
+        build_service=lambda *args, **kwargs: service,
+        entries_per_batch=entries_per_batch,
+        clock=lambda: now[0],
+        sleep=sleep,
+    )
+    send_seconds = time.perf_counter() - start
+
+    per_100 = 100 / n_entries if n_entries else 0
+    return {
+        "entries": n_entries,
+        "requests": n_requests,
+        "batches": len(batches),
+        "max_batch_payload_bytes": max([len(json.dumps({"requests": x}).encode("utf-8")) for x in batches], default=0),
+        "payload_bytes": payload_bytes,
+        "build_seconds": build_seconds,
+        "send_seconds": send_seconds,
+        "batch_updates_sent": service.n_batch_updates,
+        "requests_per_100_entries": n_requests * per_100,
+        "payload_bytes_per_100_entries": payload_bytes * per_100,
+        "build_seconds_per_100_entries": build_seconds * per_100,
+        "quota_wait_seconds": now[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Google Doc request generation offline.")
+    parser.add_argument("--entries", type=int, default=1000, help="number of synthetic entries")
+    parser.add_argument("--username", default=None, help="scrape and benchmark a real user instead")
+    parser.add_argument("--entries-per-batch", type=int, default=None, help="entries per batchUpdate (default: one batch)")
+    args = parser.parse_args()
+
+    user = User(args.username) if args.username else synthetic_user(args.entries)
+    results = run_benchmark(user, entries_per_batch=args.entries_per_batch)
+    for key, value in results.items():
+        print(f"{key:>32}: {value:,.4f}" if isinstance(value, float) else f"{key:>32}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+"""
+Profiling mode for crawls: records a per-URL timeline of every page and image request and
+writes a waterfall report of where the time went.
+
+Each URL gets timestamps (seconds since the profiler started) for the stages it went
+through, in order:
+    queued       submitted for fetching (e.g., by `prefetch_pages`)
+    started      the request was sent
+    connected    a new connection (DNS, TCP, and TLS) was set up; missing if one was reused
+    first_byte   the response headers arrived
+    body_done    the whole body was downloaded
+    parse_start  BeautifulSoup started parsing the page
+    parsed       parsing finished
+    extracted    all fields were extracted from the page
+
+The durations between stages are reported as queue, connect, server, download, parse, and
+extract time. Optionally, the parse phase is run under cProfile as well.
+
+Usage:
+    with CrawlProfiler(profile_parse=True) as profiler:
+        user = User("bcunningham")
+    profiler.write_html("crawl.html")
+    profiler.write_json("crawl.json")
+
+Or from the command line: python crawl_profiler.py bcunningham --html crawl.html
+"""
+import os
+import io
+import json
+import math
+import time
+import html
+import pstats
+import cProfile
+import argparse
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Optional
+
+import urllib3.connection
+
+import logging
+logger = logging.getLogger(__name__)
+
+STAGES = ["queued", "started", "connected", "first_byte", "body_done", "parse_start", "parsed", "extracted"]
+
+# (name, start stage, end stage); the server time starts when the request was sent if no
+# new connection was needed
+PHASES = [
+    ("queue", "queued", "started"),
+    ("connect", "started", "connected"),
+    ("server", "connected", "first_byte"),
+    ("download", "first_byte", "body_done"),
+    ("parse", "parse_start", "parsed"),
+    ("extract", "parsed", "extracted"),
+]
+
+_active: Optional["CrawlProfiler"] = None
+_local = threading.local()  # the URL being requested by the current thread
+
+
+@dataclass
+class UrlTiming:
+    url: str
+    kind: str = "page"
+    stages: Dict[str, float] = field(default_factory=dict)
+    status: Optional[int] = None
+    n_bytes: Optional[int] = None
+    error: Optional[str] = None
+
+    def phase(self, name: str, start: str, end: str) -> Optional[float]:
+        if name == "server" and start not in self.stages:
+            start = "started"
+        if start in self.stages and end in self.stages:
+            return self.stages[end] - self.stages[start]
+        return None
+
+    def phases(self) -> Dict[str, float]:
+        phases = {name: self.phase(name, start, end) for name, start, end in PHASES}
+        return {name: x for name, x in phases.items() if x is not None}
+
+    @property
+    def total(self) -> float:
+        return max(self.stages.values()) - min(self.stages.values()) if self.stages else 0.0
+
+
+class CrawlProfiler:
+    def __init__(self, profile_parse: bool = False, clock: Callable[[], float] = time.perf_counter):
+        """
+        Use as a context manager; scraper calls made inside the block are recorded. If
+        `profile_parse` is True, BeautifulSoup parsing also runs under cProfile (only one
+        parse is profiled at a time, so parses running concurrently in other threads are
+        timed but not profiled).
+        """
+        self.clock = clock
+        self.start = clock()
+        self.end = None
+        self.timings: Dict[str, UrlTiming] = {}
+        self.parse_profile = cProfile.Profile() if profile_parse else None
+        self._parse_profile_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._original_connects = {}
+
+    def __enter__(self) -> "CrawlProfiler":
+        global _active
+        if _active is not None:
+            raise RuntimeError("another crawl profiler is already active")
+        _active = self
+        self.start = self.clock()
+        self._patch_connections()
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        self._unpatch_connections()
+        self.end = self.clock()
+        _active = None
+
+    def _patch_connections(self):
+        # requests doesn't expose connection setup, so urllib3's connect is wrapped while
+        # the profiler is active
+        for cls in [urllib3.connection.HTTPConnection, urllib3.connection.HTTPSConnection]:
+            original = cls.__dict__["connect"]
+            self._original_connects[cls] = original
+
+            def connect(conn, _original=original):
+                result = _original(conn)
+                url = getattr(_local, "url", None)
+                if url is not None:
+                    mark(url, "connected")
+                return result
+
+            cls.connect = connect
+
+    def _unpatch_connections(self):
+        for cls, original in self._original_connects.items():
+            cls.connect = original
+        self._original_connects = {}
+
+    def mark(self, url: str, stage: str, kind: str = None, **info):
+        """Record the time of a stage for the URL (the first time wins) and any other info (status, n_bytes, error)."""
+        now = self.clock() - self.start
+        with self._lock:
+            timing = self.timings.get(url)
+            if timing is None:
+                timing = self.timings[url] = UrlTiming(url)
+            if kind is not None:
+                timing.kind = kind
+            timing.stages.setdefault(stage, now)
+            for key, value in info.items():
+                setattr(timing, key, value)
+
+    def slowest(self, n: int = 10) -> List[UrlTiming]:
+        return sorted(self.timings.values(), key=lambda x: x.total, reverse=True)[:n]
+
+    def summary(self) -> dict:
+        """Totals and percentiles of each phase across all URLs."""
+        phases = {}
+        for name, _, _ in PHASES:
+            values = sorted([x.phases()[name] for x in self.timings.values() if name in x.phases()])
+            if not values:
+                continue
+            phases[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "mean": sum(values) / len(values),
+                "p50": _percentile(values, 0.5),
+                "p95": _percentile(values, 0.95),
+                "max": values[-1],
+            }
+        end = self.end if self.end is not None else self.clock()
+        return {
+            "wall_time": end - self.start,
+            "n_urls": len(self.timings),
+            "n_errors": len([x for x in self.timings.values() if x.error]),
+            "phases": phases,
+        }
+
+    def parse_stats(self, limit: int = 30) -> Optional[str]:
+        """The top functions of the parse phase by cumulative time, if it was profiled."""
+        if self.parse_profile is None or not self.parse_profile.getstats():
+            return None
+        out = io.StringIO()
+        pstats.Stats(self.parse_profile, stream=out).sort_stats("cumulative").print_stats(limit)
+        return out.getvalue()
+
+    def to_dict(self, n_slowest: int = 25) -> dict:
+        return {
+            "summary": self.summary(),
+            "slowest": [{**asdict(x), "total": x.total, "phases": x.phases()} for x in self.slowest(n_slowest)],
+            "timings": [asdict(x) for x in self.timings.values()],
+            "parse_profile": self.parse_stats(),
+        }
+
+    def write_json(self, path: str, n_slowest: int = 25):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(self.to_dict(n_slowest), f, indent=4)
+
+    def write_parse_profile(self, path: str):
+        """Write the raw cProfile data of the parse phase (for snakeviz, pstats, etc.)."""
+        if self.parse_profile is None:
+            raise ValueError("parse profiling wasn't enabled")
+        self.parse_profile.dump_stats(path)
+
+    def write_html(self, path: str, n_slowest: int = 25):
+        """Write a self-contained HTML report with a summary table and a waterfall of every URL."""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            f.write(_render_html(self, n_slowest))
+
+
+def active() -> Optional[CrawlProfiler]:
+    return _active
+
+
+def mark(url: str, stage: str, **kwargs):
+    """Record a stage for the URL on the active profiler, if there is one."""
+    if _active is not None:
+        _active.mark(url, stage, **kwargs)
+
+
+@contextmanager
+def track_request(url: str, kind: str = "page"):
+    """Wrap an HTTP request for the URL: records when it started, new connections, and errors."""
+    if _active is None:
+        yield
+        return
+    _active.mark(url, "queued", kind=kind)
+    _active.mark(url, "started")
+    _local.url = url
+    try:
+        yield
+    except Exception as e:
+        mark(url, "body_done", error=repr(e))
+        raise
+    finally:
+        _local.url = None
+
+
+@contextmanager
+def track_parse(url: str):
+    """Wrap parsing of the URL's HTML, under cProfile if the active profiler is profiling parses."""
+    profiler = _active
+    if profiler is None:
+        yield
+        return
+    profiler.mark(url, "parse_start")
+    profile = profiler.parse_profile
+    if profile is not None and profiler._parse_profile_lock.acquire(blocking=False):
+        try:
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+        finally:
+            profiler._parse_profile_lock.release()
+    else:
+        yield
+    profiler.mark(url, "parsed")
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    return values[max(0, math.ceil(q * len(values)) - 1)]
+
+
+PHASE_COLORS = {
+    "queue": "#d0d0d0",
+    "connect": "#f4a261",
+    "server": "#e76f51",
+    "download": "#2a9d8f",
+    "parse": "#457b9d",
+    "extract": "#8d5fd3",
+}
+
+
+def _render_html(profiler: CrawlProfiler, n_slowest: int) -> str:
+    summary = profiler.summary()
+    scale = max([max(x.stages.values()) for x in profiler.timings.values() if x.stages] or [1.0]) or 1.0
+
+    rows = []
+    for name, stats in summary["phases"].items():
+        rows.append(
+            f"<tr><td><span class='swatch' style='background:{PHASE_COLORS[name]}'></span>{name}</td>"
+            + "".join([f"<td>{stats[x]:.3f}</td>" if x != "count" else f"<td>{stats[x]}</td>"
+                       for x in ["count", "total", "mean", "p50", "p95", "max"]])
+            + "</tr>"
+        )
+    phase_table = "\n".join(rows)
+
+    def bars(timing: UrlTiming) -> str:
+        out = []
+        for name, start, end in PHASES:
+            duration = timing.phase(name, start, end)
+            if duration is None:
+                continue
+            if name == "server" and start not in timing.stages:
+                start = "started"
+            left = 100 * timing.stages[start] / scale
+            width = max(0.1, 100 * duration / scale)
+            out.append(
+                f"<div class='bar' title='{name}: {duration:.3f}s' "
+                f"style='left:{left:.3f}%;width:{width:.3f}%;background:{PHASE_COLORS[name]}'></div>"
+            )
+        return "".join(out)
+
+    def waterfall_row(timing: UrlTiming) -> str:
+        label = html.escape(timing.url)
+        if timing.error:
+            label += f" <span class='error'>{html.escape(timing.error)}</span>"
+        return (
+            f"<tr><td class='url'>{label}</td><td>{timing.kind}</td><td>{timing.total:.3f}</td>"
+            f"<td class='lane'>{bars(timing)}</td></tr>"
+        )
+
+    ordered = sorted(profiler.timings.values(), key=lambda x: min(x.stages.values()) if x.stages else 0)
+    slowest = "\n".join([waterfall_row(x) for x in profiler.slowest(n_slowest)])
+    waterfall = "\n".join([waterfall_row(x) for x in ordered])
+    parse_stats = profiler.parse_stats()
+    parse_section = f"<h2>Parse profile</h2><pre>{html.escape(parse_stats)}</pre>" if parse_stats else ""
+
+    return f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>Crawl profile</title>
+<style>
+body {{ font-family: sans-serif; font-size: 13px; }}
+table {{ border-collapse: collapse; }}
+td, th {{ padding: 2px 8px; text-align: left; }}
+.url {{ max-width: 480px; overflow: hidden; white-space: nowrap; text-overflow: ellipsis; }}
+.lane {{ position: relative; width: 600px; height: 14px; background: #f6f6f6; }}
+.bar {{ position: absolute; top: 2px; height: 10px; }}
+.swatch {{ display: inline-block; width: 10px; height: 10px; margin-right: 4px; }}
+.error {{ color: #c00; }}
+</style>
+</head>
+<body>
+<h1>Crawl profile</h1>
+<p>{summary["n_urls"]} URLs ({summary["n_errors"]} errors) in {summary["wall_time"]:.2f}s</p>
+<h2>Phases (seconds)</h2>
+<table>
+<tr><th>phase</th><th>count</th><th>total</th><th>mean</th><th>p50</th><th>p95</th><th>max</th></tr>
+{phase_table}
+</table>
+<h2>Slowest URLs</h2>
+<table>
+<tr><th>URL</th><th>kind</th><th>total (s)</th><th>timeline</th></tr>
+{slowest}
+</table>
+<h2>Waterfall</h2>
+<table>
+<tr><th>URL</th><th>kind</th><th>total (s)</th><th>timeline</th></tr>
+{waterfall}
+</table>
+{parse_section}
+</body>
+</html>
+"""
+
+
+def main():
+    from trailjournals_scraping import Entry, Journal, User, download_image
+
+    parser = argparse.ArgumentParser(description="Profile a crawl and write a per-URL waterfall report.")
+    parser.add_argument("targets", nargs="+", help="usernames, or journal/entry URLs with --journal/--entry")
+    target_type = parser.add_mutually_exclusive_group()
+    target_type.add_argument("--journal", action="store_true", help="targets are journal URLs")
+    target_type.add_argument("--entry", action="store_true", help="targets are entry URLs")
+    parser.add_argument("--images", default=None, metavar="DIR", help="also download every entry's images here")
+    parser.add_argument("--html", default="crawl_profile.html", help="HTML report path")
+    parser.add_argument("--json", default=None, help="JSON report path")
+    parser.add_argument("--profile-parse", default=None, metavar="PATH", help="write cProfile data of the parse phase here")
+    parser.add_argument("--slowest", type=int, default=25, help="number of slowest URLs to list")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.getLevelName(os.getenv("LOGLEVEL", "INFO")))
+    with CrawlProfiler(profile_parse=args.profile_parse is not None) as profiler:
+        entries = []
+        for target in args.targets:
+            if args.entry:
+                entries.append(Entry(target))
+            elif args.journal:
+                entries += Journal(target).entries
+            else:
+                entries += [x for journal in User(target).journals for x in journal.entries]
+        if args.images:
+            os.makedirs(args.images, exist_ok=True)
+            for entry in entries:
+                for image in entry.images:
+                    download_image(image.url, os.path.join(args.images, image.url.split("/")[-1]))
+
+    profiler.write_html(args.html, n_slowest=args.slowest)
+    if args.json:
+        profiler.write_json(args.json, n_slowest=args.slowest)
+    if args.profile_parse:
+        profiler.write_parse_profile(args.profile_parse)
+
+    summary = profiler.summary()
+    print(f"{summary['n_urls']} URLs in {summary['wall_time']:.2f}s")
+    for name, stats in summary["phases"].items():
+        print(f"  {name:<9} total {stats['total']:8.3f}s  p50 {stats['p50']:.3f}s  p95 {stats['p95']:.3f}s")
+    for timing in profiler.slowest(5):
+        print(f"  {timing.total:8.3f}s  {timing.url}")
+
+
+if __name__ == "__main__":
+    main()
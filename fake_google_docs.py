@@ -0,0 +1,326 @@
+"""
+Offline stand-in for the parts of the Google Docs API used by `write_google_doc.py`.
+
+`build` has the same signature as `googleapiclient.discovery.build` and returns a service
+whose `documents().get(...)` and `documents().batchUpdate(...)` behave like the real API for
+the request types we send: requests are validated against a simplified model of the
+document's indices, and invalid requests, oversized payloads, and exceeded write quotas
+raise `googleapiclient.errors.HttpError`, as the real client does.
+
+The index model follows the Docs API: an empty document is a single "\\n" at index 1,
+inserting a table inserts a newline followed by the table, where the table, each row, and
+each cell take one index, each (empty) cell paragraph takes one index, and the table end
+takes one index. A section break is inserted with a newline before it.
+"""
+import copy
+import json
+import time
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import logging
+logger = logging.getLogger(__name__)
+
+# simulated limits (the write quota matches Google's default per-user quota)
+MAX_PAYLOAD_BYTES = 10 * 1024 * 1024
+WRITE_REQUESTS_PER_MINUTE = 60
+READ_REQUESTS_PER_MINUTE = 300
+MAX_URI_LENGTH = 2 * 1024
+
+SECTION_TYPES = ("NEXT_PAGE", "CONTINUOUS")
+
+
+def http_error(status: int, message: str, uri: str = None) -> HttpError:
+    reason = {400: "INVALID_ARGUMENT", 404: "NOT_FOUND", 429: "RESOURCE_EXHAUSTED"}.get(status, "UNKNOWN")
+    resp = httplib2.Response({"status": status, "reason": reason})
+    content = json.dumps({"error": {"code": status, "message": message, "status": reason}}).encode("utf-8")
+    return HttpError(resp, content, uri=uri)
+
+
+class InvalidRequest(ValueError):
+    pass
+
+
+@dataclass
+class FakeTable:
+    rows: int
+    columns: int
+    size: int
+    # [offset from the table start, text length] of each cell's paragraph, in document order
+    cells: List[List[int]]
+
+    @classmethod
+    def new(cls, rows: int, columns: int) -> "FakeTable":
+        """
+        Lay out an empty table by walking its structure (kept independent of the index
+        arithmetic in `write_google_doc.py`, which this model is meant to check).
+        """
+        offset = 1  # the table start
+        cells = []
+        for _ in range(rows):
+            offset += 1  # the row start
+            for _ in range(columns):
+                offset += 1  # the cell start
+                cells.append([offset, 0])
+                offset += 1  # the cell's empty paragraph ("\n")
+        return cls(rows, columns, offset + 1, cells)  # plus the table end
+
+    def cell_at(self, offset: int) -> Optional[int]:
+        """The position in `cells` of the cell whose paragraph `offset` is in, if any."""
+        for i, (start, length) in enumerate(self.cells):
+            if start <= offset <= start + length:
+                return i
+        return None
+
+
+class FakeDocument:
+    def __init__(self, document_id: str, title: str = "Untitled document"):
+        self.document_id = document_id
+        self.title = title
+        self.end_index = 2  # an empty document is a single "\n" at index 1
+        self.revision = 0
+        # start indices of the tables (sorted) and the tables
+        self.table_starts: List[int] = []
+        self.tables: List[FakeTable] = []
+
+    def apply(self, request: dict):
+        if not isinstance(request, dict) or len(request) != 1:
+            raise InvalidRequest(f"each request must have exactly one field set, got {request!r}")
+        kind, body = next(iter(request.items()))
+        handler = getattr(self, f"_apply_{kind}", None)
+        if handler is None:
+            raise InvalidRequest(f"unknown or unsupported request type: {kind}")
+        handler(body)
+
+    def _check_insert_location(self, body: dict, allow_in_table: bool = True) -> int:
+        index = body.get("location", {}).get("index")
+        if not isinstance(index, int):
+            raise InvalidRequest(f"location.index must be an integer, got {index!r}")
+        if not 1 <= index < self.end_index:
+            raise InvalidRequest(f"index {index} must be in the range [1, {self.end_index - 1}]")
+        table = self._table_containing(index)
+        if table is not None:
+            start, table = table
+            if not allow_in_table:
+                raise InvalidRequest(f"index {index} is inside the table at {start}")
+            if table.cell_at(index - start) is None:
+                raise InvalidRequest(f"index {index} must be inside a table cell, not at a table boundary")
+        return index
+
+    def _table_containing(self, index: int) -> Optional[Tuple[int, FakeTable]]:
+        """Return the start and the table containing `index`, if any (tables aren't nested)."""
+        i = bisect_right(self.table_starts, index) - 1
+        if i >= 0 and index < self.table_starts[i] + self.tables[i].size:
+            return self.table_starts[i], self.tables[i]
+        return None
+
+    def _check_range(self, body: dict, allow_empty: bool = True):
+        if not body.get("fields"):
+            raise InvalidRequest("fields is required")
+        start = body.get("range", {}).get("startIndex")
+        end = body.get("range", {}).get("endIndex")
+        if not isinstance(start, int) or not isinstance(end, int):
+            raise InvalidRequest(f"range must have integer startIndex and endIndex, got {body.get('range')!r}")
+        if not 1 <= start <= end <= self.end_index or (not allow_empty and start == end):
+            raise InvalidRequest(f"invalid range [{start}, {end}) for document ending at {self.end_index}")
+
+    def _check_table_start(self, body: dict) -> FakeTable:
+        if not body.get("fields"):
+            raise InvalidRequest("fields is required")
+        index = body.get("tableStartLocation", {}).get("index")
+        i = bisect_left(self.table_starts, index) if isinstance(index, int) else len(self.table_starts)
+        if i == len(self.table_starts) or self.table_starts[i] != index:
+            raise InvalidRequest(f"no table starts at index {index}")
+        return self.tables[i]
+
+    def _insert(self, index: int, length: int):
+        """Shift everything at or after `index` by `length`."""
+        i = bisect_left(self.table_starts, index)
+        if i > 0 and index < self.table_starts[i - 1] + self.tables[i - 1].size:
+            # inserted inside a cell: the cell grows and the later cells move
+            table = self.tables[i - 1]
+            cell = table.cell_at(index - self.table_starts[i - 1])
+            table.cells[cell][1] += length
+            for later in table.cells[cell + 1:]:
+                later[0] += length
+            table.size += length
+        for j in range(i, len(self.table_starts)):
+            self.table_starts[j] += length
+        self.end_index += length
+
+    def _apply_insertText(self, body: dict):
+        index = self._check_insert_location(body)
+        text = body.get("text")
+        if not isinstance(text, str):
+            raise InvalidRequest(f"text must be a string, got {text!r}")
+        self._insert(index, len(text))
+
+    def _apply_insertTable(self, body: dict):
+        index = self._check_insert_location(body, allow_in_table=False)
+        rows, columns = body.get("rows"), body.get("columns")
+        if not isinstance(rows, int) or not isinstance(columns, int) or rows < 1 or columns < 1:
+            raise InvalidRequest(f"rows and columns must be positive integers, got {rows!r} and {columns!r}")
+        table = FakeTable.new(rows, columns)
+        self._insert(index, 1 + table.size)  # the table is inserted after a new paragraph
+        i = bisect_left(self.table_starts, index + 1)
+        self.table_starts.insert(i, index + 1)
+        self.tables.insert(i, table)
+
+    def _apply_insertSectionBreak(self, body: dict):
+        index = self._check_insert_location(body, allow_in_table=False)
+        if body.get("sectionType") not in SECTION_TYPES:
+            raise InvalidRequest(f"sectionType must be one of {SECTION_TYPES}, got {body.get('sectionType')!r}")
+        self._insert(index, 2)
+
+    def _apply_insertInlineImage(self, body: dict):
+        index = self._check_insert_location(body)
+        uri = body.get("uri")
+        if not isinstance(uri, str) or not uri.startswith(("http://", "https://")):
+            raise InvalidRequest(f"uri must be an http(s) URL, got {uri!r}")
+        if len(uri) > MAX_URI_LENGTH:
+            raise InvalidRequest(f"uri must be at most {MAX_URI_LENGTH} bytes")
+        for dimension in ("height", "width"):
+            size = body.get("objectSize", {}).get(dimension)
+            if size is not None and size.get("magnitude", 0) <= 0:
+                raise InvalidRequest(f"objectSize.{dimension} must be positive")
+        self._insert(index, 1)
+
+    def _apply_updateParagraphStyle(self, body: dict):
+        self._check_range(body)
+
+    def _apply_updateTextStyle(self, body: dict):
+        self._check_range(body, allow_empty=False)
+
+    def _apply_updateTableCellStyle(self, body: dict):
+        self._check_table_start(body)
+
+    def _apply_updateTableColumnProperties(self, body: dict):
+        columns = self._check_table_start(body).columns
+        for i in body.get("columnIndices", []):
+            if not 0 <= i < columns:
+                raise InvalidRequest(f"column index {i} is out of range for a table with {columns} columns")
+
+    def to_dict(self) -> dict:
+        return {
+            "documentId": self.document_id,
+            "title": self.title,
+            "revisionId": str(self.revision),
+            "body": {
+                "content": [
+                    {"endIndex": 1, "sectionBreak": {}},
+                    {"startIndex": 1, "endIndex": self.end_index, "paragraph": {}},
+                ],
+            },
+        }
+
+
+class _Call:
+    """Mimics `googleapiclient.http.HttpRequest`: nothing happens until `execute()`."""
+    def __init__(self, fn: Callable[[], dict]):
+        self._fn = fn
+
+    def execute(self, num_retries: int = 0) -> dict:
+        return self._fn()
+
+
+class FakeDocumentsResource:
+    def __init__(self, service: "FakeDocsService"):
+        self._service = service
+
+    def get(self, documentId: str, **kwargs) -> _Call:
+        def fn():
+            self._service._check_quota("read")
+            return self._service._document(documentId).to_dict()
+        return _Call(fn)
+
+    def batchUpdate(self, documentId: str, body: dict, **kwargs) -> _Call:
+        return _Call(lambda: self._service._batch_update(documentId, body))
+
+
+class FakeDocsService:
+    def __init__(
+            self,
+            documents: Dict[str, FakeDocument] = None,
+            auto_create: bool = True,
+            max_payload_bytes: int = MAX_PAYLOAD_BYTES,
+            write_requests_per_minute: int = WRITE_REQUESTS_PER_MINUTE,
+            read_requests_per_minute: int = READ_REQUESTS_PER_MINUTE,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.documents_by_id = documents if documents is not None else {}
+        self.auto_create = auto_create
+        self.max_payload_bytes = max_payload_bytes
+        self.quotas = {"read": read_requests_per_minute, "write": write_requests_per_minute}
+        self.clock = clock
+        self._calls = {"read": [], "write": []}
+        # statistics for benchmarking
+        self.n_batch_updates = 0
+        self.n_requests = 0
+        self.payload_bytes = 0
+
+    def documents(self) -> FakeDocumentsResource:
+        return FakeDocumentsResource(self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _document(self, document_id: str) -> FakeDocument:
+        if document_id not in self.documents_by_id:
+            if not self.auto_create:
+                raise http_error(404, f"Requested entity was not found: {document_id}")
+            self.documents_by_id[document_id] = FakeDocument(document_id)
+        return self.documents_by_id[document_id]
+
+    def _check_quota(self, kind: str):
+        now = self.clock()
+        calls = [x for x in self._calls[kind] if now - x < 60]
+        if len(calls) >= self.quotas[kind]:
+            raise http_error(429, f"Quota exceeded for {kind} requests per minute per user")
+        calls.append(now)
+        self._calls[kind] = calls
+
+    def _batch_update(self, document_id: str, body: dict) -> dict:
+        payload_bytes = len(json.dumps(body).encode("utf-8"))
+        if payload_bytes > self.max_payload_bytes:
+            raise http_error(400, f"Request payload size {payload_bytes} exceeds the limit of {self.max_payload_bytes}")
+        self._check_quota("write")
+        requests = body.get("requests")
+        if not isinstance(requests, list) or not requests:
+            raise http_error(400, "body.requests must be a non-empty list")
+
+        # the batch is atomic: apply to a copy and only keep it if every request succeeds
+        document = copy.deepcopy(self._document(document_id))
+        for i, request in enumerate(requests):
+            try:
+                document.apply(request)
+            except InvalidRequest as e:
+                raise http_error(400, f"Invalid requests[{i}]: {e}")
+        document.revision += 1
+        self.documents_by_id[document_id] = document
+
+        self.n_batch_updates += 1
+        self.n_requests += len(requests)
+        self.payload_bytes += payload_bytes
+        logger.debug(f"applied {len(requests)} requests to {document_id} (end index {document.end_index})")
+        return {
+            "documentId": document_id,
+            "replies": [{} for _ in requests],
+            "writeControl": {"requiredRevisionId": str(document.revision)},
+        }
+
+
+def build(serviceName: str, version: str, credentials=None, **kwargs) -> FakeDocsService:
+    """Drop-in replacement for `googleapiclient.discovery.build("docs", "v1", ...)`."""
+    if (serviceName, version) != ("docs", "v1"):
+        raise ValueError(f"only the docs v1 API is faked, not {serviceName} {version}")
+    return FakeDocsService()
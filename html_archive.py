@@ -0,0 +1,217 @@
+"""
+Append-only archive of raw HTML pages, so journals can be re-parsed after a parser change
+without downloading anything again.
+
+The archive is a single file of concatenated gzip members (one per page, like a .warc.gz
+file), plus a tab-separated index file (`<path>.idx`) with the URL, offset, compressed
+length, SHA-1 of the HTML, and fetch time of each record. Pages are only ever appended;
+when a URL is archived again with different HTML, the index points to the newest record.
+If the index is lost, it can be rebuilt from the archive with `rebuild_index`.
+
+Usage:
+    archive = HtmlArchive("./data/pages.html.gz")
+    user = User("bcunningham", archive=archive)  # crawls and archives every page
+    user = User.from_archive("bcunningham", archive)  # no network access
+    reparse_user("./data/pages.html.gz", "bcunningham")  # re-parse in parallel and write JSON
+"""
+import os
+import gzip
+import zlib
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Tuple
+
+from trailjournals_scraping import Journal, discover_journals
+
+import logging
+logger = logging.getLogger(__name__)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def default_archive_path() -> str:
+    output_dir = os.getenv("OUTPUT_DIR", "./data")
+    return os.path.join(output_dir, "pages.html.gz")
+
+
+@dataclass
+class ArchiveRecord:
+    url: str
+    offset: int
+    length: int
+    sha1: str
+    fetched_at: float
+
+
+class HtmlArchive:
+    def __init__(self, path: str = None):
+        self.path = path or default_archive_path()
+        self.index_path = f"{self.path}.idx"
+        self._records: Dict[str, ArchiveRecord] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        if os.path.exists(self.index_path):
+            self._load_index()
+        elif os.path.exists(self.path) and os.path.getsize(self.path):
+            self.rebuild_index()
+
+    def _load_index(self):
+        data_size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        with open(self.index_path) as f:
+            for line in f:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) != 5:
+                    continue  # a partially written line from an interrupted append
+                url, offset, length, sha1, fetched_at = fields
+                record = ArchiveRecord(url, int(offset), int(length), sha1, float(fetched_at))
+                if record.offset + record.length <= data_size:
+                    self._records[url] = record
+
+    def append(self, url: str, html: str) -> bool:
+        """Archive the page. Return False if the newest record for the URL already has the same HTML."""
+        data = html.encode("utf-8")
+        sha1 = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            if url in self._records and self._records[url].sha1 == sha1:
+                return False
+            fetched_at = time.time()
+            header = json.dumps({"url": url, "fetched_at": fetched_at}).encode("utf-8")
+            member = gzip.compress(header + b"\n" + data, mtime=0)
+            with open(self.path, "ab") as f:
+                offset = f.tell()
+                f.write(member)
+            # the index line is only written once the record is complete
+            with open(self.index_path, "a") as f:
+                f.write(f"{url}\t{offset}\t{len(member)}\t{sha1}\t{fetched_at}\n")
+            self._records[url] = ArchiveRecord(url, offset, len(member), sha1, fetched_at)
+        return True
+
+    def get(self, url: str) -> str:
+        """Return the newest archived HTML for the URL. Raise KeyError if it isn't archived."""
+        record = self._records.get(url)
+        if record is None:
+            raise KeyError(f"{url} is not in the archive {self.path}")
+        with open(self.path, "rb") as f:
+            f.seek(record.offset)
+            member = f.read(record.length)
+        _, html = gzip.decompress(member).split(b"\n", 1)
+        return html.decode("utf-8")
+
+    def _iter_members(self, chunk_size: int = 1024 * 1024) -> Iterator[Tuple[int, int, bytes]]:
+        """
+        Yield (offset, compressed length, decompressed data) for every record in the archive
+        file. The file is streamed in chunks, so memory use doesn't grow with the archive.
+        """
+        offset = 0  # start of the current record
+        with open(self.path, "rb") as f:
+            pending = b""  # data read from the file but not consumed by a finished record
+            while True:
+                decompressor = zlib.decompressobj(wbits=31)
+                content = []
+                consumed = 0
+                while not decompressor.eof:
+                    data = pending or f.read(chunk_size)
+                    pending = b""
+                    if not data:
+                        break
+                    try:
+                        content.append(decompressor.decompress(data))
+                    except zlib.error:
+                        logger.warning(f"corrupt record at offset {offset} in {self.path}, stopping")
+                        return
+                    consumed += len(data) - len(decompressor.unused_data)
+                if not decompressor.eof:
+                    if consumed:
+                        logger.warning(f"truncated record at offset {offset} in {self.path}, stopping")
+                    return
+                pending = decompressor.unused_data
+                yield offset, consumed, b"".join(content)
+                offset += consumed
+
+    def rebuild_index(self):
+        """Recreate the index file by scanning the archive."""
+        logger.info(f"rebuilding index for {self.path}")
+        records = {}
+        for offset, length, content in self._iter_members():
+            header, html = content.split(b"\n", 1)
+            header = json.loads(header)
+            sha1 = hashlib.sha1(html).hexdigest()
+            records[header["url"]] = ArchiveRecord(header["url"], offset, length, sha1, header["fetched_at"])
+        with self._lock:
+            lines = [f"{x.url}\t{x.offset}\t{x.length}\t{x.sha1}\t{x.fetched_at}\n" for x in records.values()]
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w") as f:
+                f.writelines(lines)
+            os.replace(tmp_path, self.index_path)
+            self._records = records
+
+    def urls(self) -> List[str]:
+        return list(self._records)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._records
+
+    def __len__(self):
+        return len(self._records)
+
+    def __repr__(self):
+        return f"HtmlArchive(path={self.path}, n_pages={len(self)})"
+
+
+def _reparse_journal(archive_path: str, journal_url: str, directory: str, method: str) -> Tuple[str, int, int]:
+    """Worker for `reparse_user`: build one journal from the archive and write its entries."""
+    archive = HtmlArchive(archive_path)
+    journal = Journal(journal_url, strict=False, archive=archive, offline=True)
+    journal._write_all_entries(os.path.join(directory, journal.directory_name), method=method)
+    return journal.title, journal.n_entries, len(journal.failed_entries)
+
+
+def reparse_user(
+        archive_path: str,
+        username: str,
+        directory: str = None,
+        method: str = "json",
+        max_workers: int = None,
+) -> List[Tuple[str, int, int]]:
+    """
+    Re-parse all of a user's journals from the archive in parallel processes (one journal
+    per task, no network access) and write the entries to `directory` like
+    `User.write_all_journals_to_json`. Return (journal title, entries, failed entries) for
+    each journal.
+    """
+    if directory is None:
+        directory = os.path.join(os.getenv("OUTPUT_DIR", "./data"), username)
+    _, journal_urls = discover_journals(username, archive=HtmlArchive(archive_path), offline=True)
+    logger.info(f"re-parsing {len(journal_urls)} journals for {username} from {archive_path}")
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(_reparse_journal, archive_path, url, directory, method)
+            for url in journal_urls
+        ]
+        return [x.result() for x in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-parse archived trailjournals pages without the network.")
+    parser.add_argument("usernames", nargs="+")
+    parser.add_argument("--archive", default=None, help="archive path (defaults to $OUTPUT_DIR/pages.html.gz)")
+    parser.add_argument("--method", choices=["json", "text"], default="json")
+    parser.add_argument("--max-workers", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.getLevelName(os.getenv("LOGLEVEL", "INFO")))
+    for username in args.usernames:
+        for title, n_entries, n_failed in reparse_user(
+                args.archive or default_archive_path(), username, method=args.method, max_workers=args.max_workers
+        ):
+            print(f"{username} / {title}: {n_entries} entries, {n_failed} with errors")
+
+
+if __name__ == "__main__":
+    main()
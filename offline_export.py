@@ -0,0 +1,333 @@
+"""
+Render scraped journals to local files (Markdown, HTML, or EPUB) without the Google Docs
+API. The layout mirrors `write_google_doc.py`: a heading per journal, and for each entry a
+centered title and date, the metadata table between rules, the first image, the entry
+text, and the remaining images.
+
+Usage:
+    python offline_export.py bcunningham --format epub --output bcunningham.epub
+"""
+import io
+import os
+import html
+import uuid
+import zipfile
+import argparse
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from trailjournals_scraping import Entry, Image, Journal, User, get_image_data
+
+import logging
+logger = logging.getLogger(__name__)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+HTML_STYLE = """
+h1, h2, .date, .caption { text-align: center; }
+.date, .caption { color: #666; }
+.caption { font-style: italic; }
+.metadata { width: 100%; border-top: 1px solid #666; border-bottom: 1px solid #666; margin: 1em 0; }
+.metadata td:last-child { text-align: right; }
+figure { text-align: center; margin: 1em 0; }
+figure img { max-width: 100%; }
+.entry-text p { text-align: justify; }
+.entry { page-break-before: always; }
+"""
+
+MEDIA_TYPES = {"jpg": "image/jpeg", "png": "image/png", "gif": "image/gif", "webp": "image/webp"}
+
+
+def _journals(obj: Union[User, Journal, List[Journal]]) -> List[Journal]:
+    if isinstance(obj, list):
+        return obj
+    return obj.journals if hasattr(obj, "journals") else [obj]
+
+
+def _metadata_rows(entry: Entry) -> List[Tuple[str, str]]:
+    metadata = entry.metadata
+    return [
+        (f"Start: {metadata.start}", f"Miles: {metadata.miles}"),
+        (f"Destination: {metadata.destination}", f"Trip miles: {metadata.trip_miles}"),
+    ]
+
+
+def iter_markdown(obj: Union[User, Journal, List[Journal]]) -> Iterator[str]:
+    """Yield the Markdown book one journal heading or entry at a time."""
+    for journal in _journals(obj):
+        yield f"# {journal.title}\n\n"
+        for entry in journal.entries:
+            yield entry_to_markdown(entry)
+
+
+def entry_to_markdown(entry: Entry) -> str:
+    def image_to_markdown(image: Image) -> str:
+        out = f"![{image.caption or ''}]({image.url})\n\n"
+        if image.caption:
+            out += f"*{image.caption}*\n\n"
+        return out
+
+    out = f"## {entry.title}\n\n*{entry.date}*\n\n---\n\n"
+    if entry.metadata:
+        (start, miles), (destination, trip_miles) = _metadata_rows(entry)
+        out += f"| {start} | {miles} |\n| :-- | --: |\n| {destination} | {trip_miles} |\n\n---\n\n"
+    if entry.images:
+        out += image_to_markdown(entry.images[0])
+    out += f"{entry.text}\n\n"
+    for image in entry.images[1:]:
+        out += image_to_markdown(image)
+    return out
+
+
+def entry_to_html(entry: Entry, image_src: Callable[[Image], str] = None) -> str:
+    """
+    Render an entry as an HTML fragment. The output is also valid XHTML, so it is used for
+    EPUB as well. `image_src` maps each image to the `src` attribute (defaults to its URL).
+    """
+    if image_src is None:
+        image_src = lambda image: image.url
+
+    def image_to_html(image: Image) -> str:
+        caption = html.escape(image.caption) if image.caption else ""
+        out = f'<figure><img src="{html.escape(image_src(image))}" alt="{caption}"/>'
+        if image.caption:
+            out += f'<figcaption class="caption">{caption}</figcaption>'
+        return out + "</figure>\n"
+
+    out = (
+        f'<section class="entry">\n<h2>{html.escape(entry.title)}</h2>\n'
+        f'<p class="date">{html.escape(entry.date)}</p>\n'
+    )
+    if entry.metadata:
+        rows = "".join([
+            f"<tr><td>{html.escape(left)}</td><td>{html.escape(right)}</td></tr>"
+            for left, right in _metadata_rows(entry)
+        ])
+        out += f'<table class="metadata">{rows}</table>\n'
+    else:
+        out += "<hr/>\n"
+    if entry.images:
+        out += image_to_html(entry.images[0])
+    paragraphs = [x for x in entry.text.split("\n\n") if x.strip()]
+    out += '<div class="entry-text">\n'
+    out += "".join([f"<p>{html.escape(x)}</p>\n" for x in paragraphs])
+    out += "</div>\n"
+    for image in entry.images[1:]:
+        out += image_to_html(image)
+    return out + "</section>\n"
+
+
+def iter_html(obj: Union[User, Journal, List[Journal]], title: str = None) -> Iterator[str]:
+    """Yield a standalone HTML book one journal heading or entry at a time."""
+    if title is None:
+        title = f"Trailjournals for {obj.username}" if hasattr(obj, "username") else "Trailjournals"
+    yield (
+        f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8"/>\n<title>{html.escape(title)}</title>\n'
+        f"<style>{HTML_STYLE}</style>\n</head>\n<body>\n"
+    )
+    for journal in _journals(obj):
+        yield f"<h1>{html.escape(journal.title)}</h1>\n"
+        for entry in journal.entries:
+            yield entry_to_html(entry)
+    yield "</body>\n</html>\n"
+
+
+def _write_chunks(chunks: Iterator[str], path: str):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    logger.info(f"wrote {path}")
+
+
+def write_markdown(obj: Union[User, Journal, List[Journal]], path: str):
+    _write_chunks(iter_markdown(obj), path)
+
+
+def write_html(obj: Union[User, Journal, List[Journal]], path: str, title: str = None):
+    _write_chunks(iter_html(obj, title=title), path)
+
+
+def _import_pillow():
+    try:
+        from PIL import Image as PILImage
+    except ImportError as e:
+        raise ImportError("resizing images requires Pillow (`pip install Pillow`)") from e
+    return PILImage
+
+
+def resize_image(data: bytes, max_dimension: int) -> bytes:
+    """Shrink an image so neither side exceeds `max_dimension` pixels and return it as JPEG. Requires Pillow."""
+    PILImage = _import_pillow()
+    with PILImage.open(io.BytesIO(data)) as image:
+        image.thumbnail((max_dimension, max_dimension))
+        out = io.BytesIO()
+        image.convert("RGB").save(out, format="JPEG", quality=85)
+    return out.getvalue()
+
+
+def image_extension(data: bytes) -> Optional[str]:
+    """Identify an image from its first bytes (URLs often lack an extension or have the wrong one)."""
+    if data.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if data.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _iter_images(
+        images: List[Image],
+        max_image_dimension: int = None,
+        max_workers: int = 8,
+) -> Iterator[Tuple[str, bytes]]:
+    """
+    Download (and optionally resize) images concurrently and yield `(url, data)` as each one
+    finishes, with at most `max_workers` downloads in flight so only those are held in memory.
+    Images that fail to download are skipped.
+    """
+    def fetch(url: str) -> bytes:
+        data = get_image_data(url)
+        return resize_image(data, max_image_dimension) if max_image_dimension else data
+
+    urls = iter(dict.fromkeys([x.url for x in images]))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {executor.submit(fetch, url): url for url in islice(urls, max_workers)}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                url = pending.pop(future)
+                next_url = next(urls, None)
+                if next_url is not None:
+                    pending[executor.submit(fetch, next_url)] = next_url
+                if future.exception() is not None:
+                    logger.warning(f"failed to download image {url}: {future.exception()}")
+                    continue
+                yield url, future.result()
+
+
+def write_epub(
+        obj: Union[User, Journal, List[Journal]],
+        path: str,
+        title: str = None,
+        embed_images: bool = True,
+        max_image_dimension: int = None,
+        max_workers: int = 8,
+):
+    """
+    Write an EPUB 3 book with one chapter per journal. With `embed_images`, images are
+    downloaded (`max_workers` at once) and written to the book as each one finishes,
+    resized to `max_image_dimension` pixels if given (requires Pillow); otherwise the
+    chapters link to the remote images.
+    """
+    if title is None:
+        title = f"Trailjournals for {obj.username}" if hasattr(obj, "username") else "Trailjournals"
+    if embed_images and max_image_dimension:
+        _import_pillow()  # fail before downloading anything rather than once per image
+    journals = _journals(obj)
+    manifest = []  # (id, href, media type, properties)
+    chapters = []  # (id, href, title)
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        # the mimetype file must come first and be stored uncompressed
+        zf.writestr("mimetype", "application/epub+zip", compress_type=zipfile.ZIP_STORED)
+        zf.writestr(
+            "META-INF/container.xml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">\n'
+            '<rootfiles><rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/></rootfiles>\n'
+            "</container>\n",
+        )
+        zf.writestr("OEBPS/style.css", HTML_STYLE)
+        manifest.append(("style", "style.css", "text/css", ""))
+
+        image_names = {}
+        for i, journal in enumerate(journals):
+            if embed_images:
+                images = [image for entry in journal.entries for image in entry.images]
+                for url, data in _iter_images(images, max_image_dimension, max_workers):
+                    extension = image_extension(data)
+                    if extension is None:
+                        logger.warning(f"unrecognized image format for {url}, linking to it instead")
+                        continue
+                    name = f"images/image_{len(image_names):05}.{extension}"
+                    image_names[url] = name
+                    zf.writestr(f"OEBPS/{name}", data, compress_type=zipfile.ZIP_STORED)
+                    manifest.append((f"image_{len(image_names)}", name, MEDIA_TYPES[extension], ""))
+
+            chapter = f"journal_{i + 1:03}.xhtml"
+            with zf.open(f"OEBPS/{chapter}", "w") as f:
+                f.write((
+                    '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+                    '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+                    f'<head><meta charset="utf-8"/><title>{html.escape(journal.title)}</title>'
+                    '<link rel="stylesheet" type="text/css" href="style.css"/></head>\n<body>\n'
+                    f"<h1>{html.escape(journal.title)}</h1>\n"
+                ).encode("utf-8"))
+                for entry in journal.entries:
+                    f.write(entry_to_html(entry, image_src=lambda x: image_names.get(x.url, x.url)).encode("utf-8"))
+                f.write(b"</body>\n</html>\n")
+            # chapters that link to images outside the book must declare it
+            remote = any([x.url not in image_names for entry in journal.entries for x in entry.images])
+            manifest.append((f"journal_{i + 1}", chapter, "application/xhtml+xml", "remote-resources" if remote else ""))
+            chapters.append((f"journal_{i + 1}", chapter, journal.title))
+
+        toc = "".join([f'<li><a href="{href}">{html.escape(name)}</a></li>' for _, href, name in chapters])
+        zf.writestr(
+            "OEBPS/nav.xhtml",
+            '<?xml version="1.0" encoding="UTF-8"?>\n<!DOCTYPE html>\n'
+            '<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops">\n'
+            f"<head><title>{html.escape(title)}</title></head>\n"
+            f'<body><nav epub:type="toc"><h1>Contents</h1><ol>{toc}</ol></nav></body>\n</html>\n',
+        )
+        items = "".join([
+            f'<item id="{item_id}" href="{href}" media-type="{media_type}"'
+            + (f' properties="{properties}"' if properties else "")
+            + "/>\n"
+            for item_id, href, media_type, properties in manifest
+        ])
+        spine = "".join([f'<itemref idref="{item_id}"/>' for item_id, _, _ in chapters])
+        modified = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+        zf.writestr(
+            "OEBPS/content.opf",
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="book-id">\n'
+            '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/">\n'
+            f'<dc:identifier id="book-id">urn:uuid:{uuid.uuid4()}</dc:identifier>\n'
+            f"<dc:title>{html.escape(title)}</dc:title>\n<dc:language>en</dc:language>\n"
+            f'<meta property="dcterms:modified">{modified}</meta>\n</metadata>\n'
+            f'<manifest>\n<item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>\n'
+            f"{items}</manifest>\n<spine>{spine}</spine>\n</package>\n",
+        )
+    logger.info(f"wrote {path} ({len(chapters)} journals, {len(image_names)} embedded images)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a user's journals to a local book.")
+    parser.add_argument("username")
+    parser.add_argument("--format", choices=["markdown", "html", "epub"], default="html")
+    parser.add_argument("--output", default=None, help="output path (defaults to $OUTPUT_DIR/<username>.<ext>)")
+    parser.add_argument("--no-images", action="store_true", help="don't embed images in the EPUB")
+    parser.add_argument("--max-image-dimension", type=int, default=None, help="resize embedded images (requires Pillow)")
+    args = parser.parse_args()
+
+    extension = {"markdown": "md", "html": "html", "epub": "epub"}[args.format]
+    path = args.output or os.path.join(os.getenv("OUTPUT_DIR", "./data"), f"{args.username}.{extension}")
+    user = User(args.username)
+    if args.format == "markdown":
+        write_markdown(user, path)
+    elif args.format == "html":
+        write_html(user, path)
+    else:
+        write_epub(user, path, embed_images=not args.no_images, max_image_dimension=args.max_image_dimension)
+
+
+if __name__ == "__main__":
+    main()
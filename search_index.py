@@ -0,0 +1,263 @@
+import os
+import re
+import gzip
+import json
+import math
+import heapq
+import hashlib
+import argparse
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+from trailjournals_scraping import Entry, Journal, User, write_file_atomic
+
+import logging
+logger = logging.getLogger(__name__)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+# letters and digits in any script, with apostrophes inside words ("didn't")
+TOKEN_PATTERN = re.compile(r"[^\W_]+(?:'[^\W_]+)*")
+
+# matches in titles and place names count more than matches in the entry body
+TITLE_WEIGHT = 3
+PLACE_WEIGHT = 2
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def tokenize(text: str) -> List[str]:
+    # journals are often typed on phones, which use curly apostrophes
+    return TOKEN_PATTERN.findall(text.lower().replace("\u2019", "'")) if text else []
+
+
+def default_index_path() -> str:
+    output_dir = os.getenv("OUTPUT_DIR", "./data")
+    return os.path.join(output_dir, "search_index.json.gz")
+
+
+@dataclass
+class SearchHit:
+    score: float
+    username: str
+    journal: str
+    entry: str
+    date: str
+    url: str
+
+
+class SearchIndex:
+    """
+    Inverted index over journal entries. Each term maps to a dict of {doc_id: weighted term
+    frequency}, and queries are ranked with BM25. Entries are keyed by URL, so adding an
+    entry that is already indexed with the same content is a no-op, and adding a changed
+    entry replaces the old version.
+    """
+    FORMAT_VERSION = 2  # 2: Unicode tokens
+
+    def __init__(self):
+        # doc_id -> document fields, or None if the document was replaced
+        self._docs: List[Optional[dict]] = []
+        self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._url_to_doc: Dict[str, int] = {}
+        self._total_length = 0
+
+    def add_user(self, user: User) -> int:
+        return sum([self.add_journal(journal) for journal in user.journals])
+
+    def add_journal(self, journal: Journal) -> int:
+        n_added = sum([self.add_entry(entry) for entry in journal.entries])
+        logger.debug(f"indexed {n_added} new or changed entries from {journal.title}")
+        return n_added
+
+    def add_entry(self, entry: Entry) -> bool:
+        """Index an entry. Return False if it was already indexed with the same content."""
+        journal = entry.journal
+        user = journal.user if journal is not None else None
+        metadata = entry.metadata
+        fields = [entry.title, entry.text, metadata.start, metadata.destination]
+        digest = hashlib.sha1("\0".join(fields).encode("utf-8")).hexdigest()
+
+        doc_id = self._url_to_doc.get(entry.url)
+        if doc_id is not None:
+            if self._docs[doc_id]["hash"] == digest:
+                return False
+            self._remove(doc_id)
+
+        counts = Counter(tokenize(entry.text))
+        for token in tokenize(entry.title):
+            counts[token] += TITLE_WEIGHT
+        for token in tokenize(metadata.start) + tokenize(metadata.destination):
+            counts[token] += PLACE_WEIGHT
+
+        doc_id = len(self._docs)
+        length = sum(counts.values())
+        self._docs.append({
+            "url": entry.url,
+            "username": user.username if user is not None else "",
+            "journal": journal.title if journal is not None else "",
+            "entry": entry.title,
+            "date": entry.date,
+            "length": length,
+            "hash": digest,
+        })
+        self._url_to_doc[entry.url] = doc_id
+        self._total_length += length
+        for term, count in counts.items():
+            self._postings[term][doc_id] = count
+        return True
+
+    def _remove(self, doc_id: int):
+        doc = self._docs[doc_id]
+        self._docs[doc_id] = None
+        del self._url_to_doc[doc["url"]]
+        self._total_length -= doc["length"]
+        # postings for the old document are dropped lazily, when the index is compacted
+
+    def search(self, query: str, limit: int = 10, username: str = None) -> List[SearchHit]:
+        """Return the top `limit` entries matching any of the query terms, best first."""
+        n_docs = self.n_documents
+        if n_docs == 0:
+            return []
+        avg_length = self._total_length / n_docs
+
+        scores = defaultdict(float)
+        for term in set(tokenize(query)):
+            # replaced documents keep their postings until the index is compacted
+            postings = [
+                (doc_id, tf) for doc_id, tf in self._postings.get(term, {}).items()
+                if self._docs[doc_id] is not None
+            ]
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n_docs - df + 0.5) / (df + 0.5))
+            for doc_id, tf in postings:
+                doc = self._docs[doc_id]
+                if username is not None and doc["username"] != username:
+                    continue
+                norm = 1 - B + B * doc["length"] / avg_length
+                scores[doc_id] += idf * tf * (K1 + 1) / (tf + K1 * norm)
+
+        top = heapq.nlargest(limit, scores.items(), key=lambda x: x[1])
+        return [
+            SearchHit(
+                score=score,
+                username=self._docs[doc_id]["username"],
+                journal=self._docs[doc_id]["journal"],
+                entry=self._docs[doc_id]["entry"],
+                date=self._docs[doc_id]["date"],
+                url=self._docs[doc_id]["url"],
+            )
+            for doc_id, score in top
+        ]
+
+    def _compact(self):
+        """Drop replaced documents and renumber the rest."""
+        if self.n_documents == len(self._docs):
+            return
+        new_ids = {}
+        docs = []
+        for doc_id, doc in enumerate(self._docs):
+            if doc is not None:
+                new_ids[doc_id] = len(docs)
+                docs.append(doc)
+        postings = defaultdict(dict)
+        for term, doc_tfs in self._postings.items():
+            for doc_id, tf in doc_tfs.items():
+                if doc_id in new_ids:
+                    postings[term][new_ids[doc_id]] = tf
+        self._docs = docs
+        self._postings = postings
+        self._url_to_doc = {doc["url"]: doc_id for doc_id, doc in enumerate(docs)}
+
+    def save(self, path: str = None) -> bool:
+        """
+        Write the index to a gzipped JSON file. Documents are stored as rows and each posting
+        list is stored as a flat list of [doc_id delta, tf, doc_id delta, tf, ...].
+        """
+        if path is None:
+            path = default_index_path()
+        self._compact()
+        postings = {}
+        for term, doc_tfs in self._postings.items():
+            flat = []
+            previous = 0
+            for doc_id in sorted(doc_tfs):
+                flat += [doc_id - previous, doc_tfs[doc_id]]
+                previous = doc_id
+            postings[term] = flat
+        data = {
+            "version": self.FORMAT_VERSION,
+            "docs": [
+                [d["url"], d["username"], d["journal"], d["entry"], d["date"], d["length"], d["hash"]]
+                for d in self._docs
+            ],
+            "postings": postings,
+        }
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        content = gzip.compress(json.dumps(data, separators=(",", ":")).encode("utf-8"), mtime=0)
+        logger.info(f"writing search index ({self.n_documents} entries, {len(postings)} terms) to {path}")
+        return write_file_atomic(path, content)
+
+    @classmethod
+    def load(cls, path: str = None) -> "SearchIndex":
+        if path is None:
+            path = default_index_path()
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("version") != cls.FORMAT_VERSION:
+            raise ValueError(f"unsupported search index version: {data.get('version')} (delete {path} to rebuild it)")
+
+        index = cls()
+        keys = ["url", "username", "journal", "entry", "date", "length", "hash"]
+        index._docs = [dict(zip(keys, row)) for row in data["docs"]]
+        index._url_to_doc = {doc["url"]: doc_id for doc_id, doc in enumerate(index._docs)}
+        index._total_length = sum([doc["length"] for doc in index._docs])
+        for term, flat in data["postings"].items():
+            doc_id = 0
+            doc_tfs = {}
+            for i in range(0, len(flat), 2):
+                doc_id += flat[i]
+                doc_tfs[doc_id] = flat[i + 1]
+            index._postings[term] = doc_tfs
+        return index
+
+    @property
+    def n_documents(self) -> int:
+        return len(self._url_to_doc)
+
+    def __contains__(self, url: str) -> bool:
+        return url in self._url_to_doc
+
+    def __repr__(self):
+        return f"SearchIndex(n_documents={self.n_documents}, n_terms={len(self._postings)})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search scraped trailjournals entries.")
+    parser.add_argument("query", nargs="?", help="search terms")
+    parser.add_argument("--index", default=None, help="index path (defaults to $OUTPUT_DIR/search_index.json.gz)")
+    parser.add_argument("--add", nargs="+", default=[], metavar="USERNAME", help="scrape and index these users")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+
+    path = args.index or default_index_path()
+    index = SearchIndex.load(path) if os.path.exists(path) else SearchIndex()
+    if args.add:
+        for username in args.add:
+            n_added = index.add_user(User(username))
+            logger.info(f"indexed {n_added} new or changed entries for {username}")
+        index.save(path)
+
+    if args.query:
+        for hit in index.search(args.query, limit=args.limit):
+            print(f"{hit.score:6.2f}  {hit.username} / {hit.journal} / {hit.entry} ({hit.date})\n        {hit.url}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import pytest
+
+
+ENTRY_HTML = """
+<h2 class="entry-title">Day 1</h2>
+<div class="entry-date">Saturday, July 08, 2023</div>
+<div class="entry-text"><span class="entry-text-detail">Hawk Mountain Shelter</span></div>
+<div class="entry-text"><span class="entry-text-detail">Springer Mountain</span></div>
+<div class="entry-text-right"><span class="entry-text-detail">8.1</span></div>
+<div class="entry-text-right"><span class="entry-text-detail">8.1</span></div>
+<div class="entry"><p>Off we go.</p></div>
+"""
+
+
+@pytest.fixture
+def entry_html() -> str:
+    """An entry page as served by trailjournals.com."""
+    return ENTRY_HTML
+
+
+@pytest.fixture
+def site_pages(entry_html) -> dict:
+    """Every page of a user with one journal of one entry, by URL."""
+    return {
+        "https://www.trailjournals.com/hiker": """
+            <li class="other-journals"><a href="/journal/others/1">Other Journals</a></li>
+        """,
+        "https://www.trailjournals.com/journal/others/1": """
+            <div class="media-body"><a class="btn-primary" href="/journal/1">2023</a></div>
+        """,
+        "https://www.trailjournals.com/journal/entries/1": """
+            <h1 class="journal-title">Hiker 2023<br/>Appalachian Trail 2023</h1>
+            <table><tr><td><a href="/entry/1">Day 1</a></td></tr></table>
+        """,
+        "https://www.trailjournals.com/entry/1": entry_html,
+    }
+
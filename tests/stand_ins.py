@@ -0,0 +1,43 @@
+"""Stand-ins for `Entry` and `Journal` with the attributes the exporters, the search index and `EntryColumns` read."""
+from datetime import date
+from types import SimpleNamespace
+from typing import List, Optional
+
+from trailjournals_scraping import Entry, EntryMetadata, Image, format_trailjournals_url, replace_spaces_and_dashes
+
+
+def make_entry(
+        title: str = "Day 1",
+        entry_date: Optional[date] = date(2023, 7, 8),
+        text: str = "",
+        start: str = "",
+        destination: str = "",
+        miles: str = "",
+        trip_miles: str = "",
+        images: List[Image] = None,
+        url: str = None,
+        journal: SimpleNamespace = None,
+) -> SimpleNamespace:
+    return SimpleNamespace(
+        url=format_trailjournals_url(url or f"/entry/{replace_spaces_and_dashes(title)}"),
+        title=title,
+        entry_date=entry_date,
+        date=Entry._format_entry_date(entry_date) if entry_date else "",
+        metadata=EntryMetadata(start=start, destination=destination, miles=miles, trip_miles=trip_miles),
+        text=text,
+        images=images or [],
+        journal=journal,
+    )
+
+
+def make_journal(
+        entries: List[SimpleNamespace] = None,
+        title: str = "Appalachian Trail",
+        year: str = "2023",
+        user: SimpleNamespace = None,
+) -> SimpleNamespace:
+    """The entries are linked back to the journal."""
+    journal = SimpleNamespace(title=title, year=year, entries=entries or [], user=user)
+    for entry in journal.entries:
+        entry.journal = journal
+    return journal
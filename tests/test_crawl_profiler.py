@@ -0,0 +1,112 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+import crawl_profiler
+from crawl_profiler import CrawlProfiler
+from trailjournals_scraping import Entry, fetch_html, get_image_data
+
+
+class Handler(BaseHTTPRequestHandler):
+    page = b""
+
+    def do_GET(self):
+        body = self.page if self.path != "/missing" else b""
+        self.send_response(200 if body else 404)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server_url(entry_html, monkeypatch):
+    monkeypatch.setattr(Handler, "page", entry_html.encode("utf-8"))
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_profiler_records_timeline(tmp_path, server_url, entry_html):
+    with CrawlProfiler(profile_parse=True) as profiler:
+        html = fetch_html(f"{server_url}/entry")
+        get_image_data(f"{server_url}/image.jpg")
+        with pytest.raises(Exception):
+            fetch_html(f"{server_url}/missing")
+        entry = Entry("/entry/1", html=html)
+    assert crawl_profiler.active() is None
+
+    page = profiler.timings[f"{server_url}/entry"]
+    assert list(page.stages) == ["queued", "started", "connected", "first_byte", "body_done"]
+    assert page.stages["body_done"] >= page.stages["started"]
+    assert (page.kind, page.status, page.n_bytes) == ("page", 200, len(entry_html.encode("utf-8")))
+    assert profiler.timings[f"{server_url}/image.jpg"].kind == "image"
+    assert profiler.timings[f"{server_url}/missing"].error is not None
+
+    parsed = profiler.timings[entry.url]
+    assert list(parsed.stages) == ["parse_start", "parsed", "extracted"]
+    assert set(parsed.phases()) == {"parse", "extract"}
+
+    summary = profiler.summary()
+    assert summary["n_urls"] == 4
+    assert summary["n_errors"] == 1
+    assert summary["phases"]["server"]["count"] == 3
+    assert "BeautifulSoup" in profiler.parse_stats() or "bs4" in profiler.parse_stats()
+
+    profiler.write_json(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as f:
+        report = json.load(f)
+    assert len(report["timings"]) == 4
+    profiler.write_html(str(tmp_path / "report.html"))
+    assert "Waterfall" in (tmp_path / "report.html").read_text()
+
+
+def test_nothing_is_recorded_without_a_profiler(entry_html):
+    entry = Entry("/entry/1", html=entry_html)
+    assert entry.title == "Day 1"
+    assert crawl_profiler.active() is None
+
+
+def test_failed_responses_are_closed(monkeypatch):
+    responses = []
+
+    class FakeResponse:
+        status_code = 500
+        closed = False
+
+        def raise_for_status(self):
+            raise requests.HTTPError("500")
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            self.closed = True
+
+    def fake_get(url, **kwargs):
+        responses.append((FakeResponse(), kwargs["stream"]))
+        return responses[-1][0]
+
+    monkeypatch.setattr(requests, "get", fake_get)
+    with pytest.raises(requests.HTTPError):
+        fetch_html("https://www.trailjournals.com/entry/1")
+    with CrawlProfiler():
+        with pytest.raises(requests.HTTPError):
+            get_image_data("https://www.trailjournals.com/image.jpg")
+    assert [(x.closed, stream) for x, stream in responses] == [(True, False), (True, True)]
+
+
+def test_percentile_is_nearest_rank():
+    assert crawl_profiler._percentile([1, 2], 0.5) == 1
+    assert crawl_profiler._percentile([1, 2, 3, 4, 5, 6], 0.5) == 3
+    assert crawl_profiler._percentile([1, 2, 3], 0.5) == 2
+    assert crawl_profiler._percentile(list(range(1, 21)), 0.95) == 19
+    assert crawl_profiler._percentile([7], 0.0) == 7
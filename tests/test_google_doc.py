@@ -0,0 +1,151 @@
+import pytest
+from googleapiclient.errors import HttpError
+
+import write_google_doc
+from benchmark_google_doc import synthetic_user
+from fake_google_docs import FakeDocsService, build
+
+
+def test_fake_docs_accepts_generated_requests():
+    user = synthetic_user(n_entries=5, entries_per_journal=3)
+    request_list = write_google_doc.build_request_list(user)
+    service = FakeDocsService()
+    write_google_doc.write_to_google_doc(user, "doc", build_service=lambda *args, **kwargs: service)
+    assert service.n_batch_updates == 1
+    assert service.n_requests == len(request_list)
+    end_index = service.documents().get(documentId="doc").execute()["body"]["content"][-1]["endIndex"]
+    assert end_index > 2
+
+
+def test_document_builder_tracks_end_index():
+    user = synthetic_user(n_entries=7, entries_per_journal=3)
+    service = FakeDocsService()
+    write_google_doc.write_to_google_doc(user, "doc", build_service=lambda *args, **kwargs: service, entries_per_batch=2)
+    assert service.n_batch_updates == 4
+
+    builder = write_google_doc.DocumentBuilder()
+    for journal in user.journals:
+        for entry in journal.entries:
+            write_google_doc.add_entry(builder, entry)
+    end_index = service.documents_by_id["doc"].end_index
+    # same content apart from the journal titles and the section breaks between journals
+    titles = sum([len(x.title) for x in user.journals]) + 2 * (len(user.journals) - 1)
+    assert builder.index + 1 + titles == end_index
+
+    # inserts are in forward order at increasing indices
+    inserts = [x for x in write_google_doc.build_request_list(user) if "insertText" in x and x["insertText"]["text"]]
+    indices = [x["insertText"]["location"]["index"] for x in inserts]
+    assert indices[0] == 1
+    assert indices == sorted(indices)
+
+
+def test_metadata_table_cell_indices():
+    builder = write_google_doc.DocumentBuilder()
+    entry = synthetic_user(n_entries=1).journals[0].entries[0]
+    write_google_doc.process_entry_metadata(builder, entry)
+    inserts = [x["insertText"] for x in builder.flush() if "insertText" in x]
+    start = f"Start: {entry.metadata.start}"
+    miles = f"Miles: {entry.metadata.miles}"
+    destination = f"Destination: {entry.metadata.destination}"
+    # a 2x2 table inserted at index 1 has empty cells at 5, 7, 10 and 12
+    assert [x["location"]["index"] for x in inserts] == [
+        5,
+        7 + len(start),
+        10 + len(start) + len(miles),
+        12 + len(start) + len(miles) + len(destination),
+    ]
+
+
+def test_fake_docs_rejects_invalid_requests():
+    with build("docs", "v1") as service:
+        documents = service.documents()
+        bad_requests = [
+            {"insertText": {"location": {"index": 5}, "text": "past the end"}},
+            {"insertTable": {"location": {"index": 1}, "columns": 0, "rows": 1}},
+            {"updateTableCellStyle": {"tableStartLocation": {"index": 2}, "fields": "*", "tableCellStyle": {}}},
+            {"updateTextStyle": {"range": {"startIndex": 1, "endIndex": 1}, "fields": "italic", "textStyle": {}}},
+            {"insertText": {"location": {"index": 1}, "text": "two"}, "insertTable": {"location": {"index": 1}}},
+        ]
+        for request in bad_requests:
+            with pytest.raises(HttpError):
+                documents.batchUpdate(documentId="doc", body={"requests": [request]}).execute()
+
+        # text can only go into a cell's paragraph, not at the boundary between two cells
+        with pytest.raises(HttpError):
+            documents.batchUpdate(documentId="doc", body={"requests": [
+                {"insertTable": {"location": {"index": 1}, "columns": 2, "rows": 2}},
+                {"insertText": {"location": {"index": 6}, "text": "x"}},
+            ]}).execute()
+
+        # failed batches are not applied
+        documents.batchUpdate(documentId="doc", body={"requests": [
+            {"insertTable": {"location": {"index": 1}, "columns": 2, "rows": 2}},
+            # cell indices of a 2x2 table inserted at index 1
+            *[{"insertText": {"location": {"index": i}, "text": "x"}} for i in (12, 10, 7, 5)],
+            {"updateTableColumnProperties": {"tableStartLocation": {"index": 2}, "columnIndices": [1], "fields": "*"}},
+        ]}).execute()
+        assert service.documents_by_id["doc"].end_index == 2 + 1 + 12 + 4
+
+
+def test_fake_docs_write_quota():
+    now = [0.0]
+    service = FakeDocsService(write_requests_per_minute=2, clock=lambda: now[0])
+    body = {"requests": [{"insertText": {"location": {"index": 1}, "text": "x"}}]}
+    service.documents().batchUpdate(documentId="doc", body=body).execute()
+    service.documents().batchUpdate(documentId="doc", body=body).execute()
+    with pytest.raises(HttpError) as e:
+        service.documents().batchUpdate(documentId="doc", body=body).execute()
+    assert e.value.resp.status == 429
+    now[0] = 61.0
+    service.documents().batchUpdate(documentId="doc", body=body).execute()
+
+
+def test_writes_are_paced_under_the_quota():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    user = synthetic_user(n_entries=7, entries_per_journal=3, images_per_entry=0)
+    service = FakeDocsService(write_requests_per_minute=3, clock=lambda: now[0])
+    write_google_doc.write_to_google_doc(
+        user,
+        "doc",
+        build_service=lambda *args, **kwargs: service,
+        entries_per_batch=1,
+        writes_per_minute=3,
+        clock=lambda: now[0],
+        sleep=sleep,
+    )
+    assert service.n_batch_updates == 7
+    assert waits == [60.0, 60.0]
+
+
+def test_quota_errors_are_retried():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    # another writer shares the quota, so pacing alone isn't enough
+    service = FakeDocsService(write_requests_per_minute=3, clock=lambda: now[0])
+    body = {"requests": [{"insertText": {"location": {"index": 1}, "text": "x"}}]}
+    for _ in range(3):
+        service.documents().batchUpdate(documentId="doc", body=body).execute()
+    user = synthetic_user(n_entries=1, images_per_entry=0)
+    write_google_doc.write_to_google_doc(
+        user, "doc", build_service=lambda *args, **kwargs: service, clock=lambda: now[0], sleep=sleep,
+    )
+    assert service.n_batch_updates == 4
+    assert waits == [1, 2, 4, 8, 16, 32]
+
+    for _ in range(2):
+        service.documents().batchUpdate(documentId="doc", body=body).execute()
+    with pytest.raises(HttpError):
+        write_google_doc.execute_with_retries(
+            service.documents().batchUpdate(documentId="doc", body=body), sleep=lambda seconds: None, max_retries=2,
+        )
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+import trailjournals_scraping
+from html_archive import HtmlArchive, reparse_user
+from trailjournals_scraping import User
+
+
+def test_archive_append_and_get(tmp_path):
+    archive = HtmlArchive(str(tmp_path / "pages.html.gz"))
+    assert archive.append("https://example.com/a", "<p>a</p>")
+    assert not archive.append("https://example.com/a", "<p>a</p>")  # unchanged, not stored again
+    assert archive.append("https://example.com/b", "<p>b</p>")
+    assert archive.append("https://example.com/a", "<p>a2</p>")
+    assert archive.get("https://example.com/a") == "<p>a2</p>"
+    assert len(archive) == 2
+    with pytest.raises(KeyError):
+        archive.get("https://example.com/missing")
+
+    # the index is rebuilt from the archive if it's lost
+    os.remove(archive.index_path)
+    archive = HtmlArchive(archive.path)
+    assert archive.get("https://example.com/a") == "<p>a2</p>"
+    assert archive.get("https://example.com/b") == "<p>b</p>"
+
+
+def test_archive_index_rebuild_streams_records(tmp_path):
+    archive = HtmlArchive(str(tmp_path / "pages.html.gz"))
+    pages = {f"https://example.com/{i}": f"<p>{i}</p>" * (i + 1) for i in range(5)}
+    for url, html in pages.items():
+        archive.append(url, html)
+    with open(archive.path, "ab") as f:
+        f.write(b"\x1f\x8b\x08")  # an interrupted append
+    members = list(archive._iter_members(chunk_size=7))
+    assert [(x[0], x[1]) for x in members] == [(archive._records[url].offset, archive._records[url].length) for url in pages]
+
+    os.remove(archive.index_path)
+    archive = HtmlArchive(archive.path)
+    assert {url: archive.get(url) for url in archive.urls()} == pages
+
+
+def test_user_from_archive(tmp_path, monkeypatch, site_pages):
+    monkeypatch.setenv("DISCOVERY_CACHE", str(tmp_path / "cache.json"))
+    monkeypatch.setattr(trailjournals_scraping, "get_html", lambda url: site_pages[url])
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", lambda url: site_pages[url])
+    archive = HtmlArchive(str(tmp_path / "pages.html.gz"))
+    User("hiker", archive=archive)
+    assert sorted(archive.urls()) == sorted(site_pages)
+
+    def no_network(url):
+        raise AssertionError(f"unexpected request for {url}")
+
+    monkeypatch.setattr(trailjournals_scraping, "get_html", no_network)
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", no_network)
+    user = User.from_archive("hiker", archive)
+    journal = user.journals[0]
+    assert (journal.year, journal.title) == ("2023", "Appalachian Trail")
+    assert journal.entries[0].title == "Day 1"
+
+    results = reparse_user(archive.path, "hiker", directory=str(tmp_path / "out"), max_workers=1)
+    assert results == [("Appalachian Trail", 1, 0)]
+    assert os.listdir(tmp_path / "out" / journal.directory_name) == ["1_Day_1.json"]
@@ -0,0 +1,105 @@
+import zipfile
+from datetime import date
+
+import pytest
+
+import offline_export
+from stand_ins import make_entry, make_journal
+from trailjournals_scraping import Image
+from offline_export import entry_to_html, iter_markdown, write_epub
+
+
+def sample_journal():
+    return make_journal([
+        make_entry(
+            "Day 1 <start>",
+            start="Springer Mountain",
+            destination="Hawk Mountain",
+            miles="8.1",
+            trip_miles="8.1",
+            text="First paragraph.\n\nSecond paragraph & more.",
+            images=[Image("/images/lead.jpg", caption="The arch"), Image("/images/after.jpg")],
+        ),
+        make_entry("Day 2", date(2023, 7, 9), text="Rain."),
+    ])
+
+
+def test_markdown_layout():
+    markdown = "".join(iter_markdown(sample_journal()))
+    assert markdown.startswith("# Appalachian Trail\n\n## Day 1 <start>\n\n*Saturday, July 8th, 2023*\n\n---\n\n")
+    assert "| Start: Springer Mountain | Miles: 8.1 |" in markdown
+    # lead image, then the text, then the remaining images
+    lead = markdown.index("![The arch](https://www.trailjournals.com/images/lead.jpg)")
+    assert lead < markdown.index("First paragraph.") < markdown.index("/images/after.jpg")
+    assert "| Start: |" not in markdown
+
+
+def test_html_is_escaped():
+    out = entry_to_html(sample_journal().entries[0])
+    assert "<h2>Day 1 &lt;start&gt;</h2>" in out
+    assert "<p>Second paragraph &amp; more.</p>" in out
+    assert '<figcaption class="caption">The arch</figcaption>' in out
+
+
+def test_epub_structure(tmp_path):
+    path = str(tmp_path / "book.epub")
+    write_epub([sample_journal()], path, title="Test book", embed_images=False)
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        assert names[0] == "mimetype"
+        assert zf.getinfo("mimetype").compress_type == zipfile.ZIP_STORED
+        assert {"META-INF/container.xml", "OEBPS/content.opf", "OEBPS/nav.xhtml", "OEBPS/journal_001.xhtml"} <= set(names)
+        chapter = zf.read("OEBPS/journal_001.xhtml").decode("utf-8")
+        assert "<h1>Appalachian Trail</h1>" in chapter
+        assert "https://www.trailjournals.com/images/lead.jpg" in chapter
+        opf = zf.read("OEBPS/content.opf").decode("utf-8")
+        assert 'href="journal_001.xhtml" media-type="application/xhtml+xml" properties="remote-resources"' in opf
+
+
+def test_epub_image_media_types(tmp_path, monkeypatch):
+    data = {
+        "https://www.trailjournals.com/images/lead.jpg": b"\x89PNG\r\n\x1a\n" + b"0" * 16,  # a PNG despite the URL
+        "https://www.trailjournals.com/images/after.jpg": b"not an image",
+    }
+    monkeypatch.setattr(offline_export, "get_image_data", lambda url: data[url])
+    path = str(tmp_path / "book.epub")
+    write_epub([sample_journal()], path, embed_images=True)
+    with zipfile.ZipFile(path) as zf:
+        opf = zf.read("OEBPS/content.opf").decode("utf-8")
+        chapter = zf.read("OEBPS/journal_001.xhtml").decode("utf-8")
+    assert 'href="images/image_00000.png" media-type="image/png"' in opf
+    # the unrecognized image stays remote, so the chapter is marked as using remote resources
+    assert "https://www.trailjournals.com/images/after.jpg" in chapter
+    assert 'properties="remote-resources"' in opf
+
+
+def test_epub_resizing_requires_pillow(tmp_path, monkeypatch):
+    def no_pillow():
+        raise ImportError("resizing images requires Pillow (`pip install Pillow`)")
+
+    def no_download(url):
+        raise AssertionError(f"unexpected download of {url}")
+
+    monkeypatch.setattr(offline_export, "_import_pillow", no_pillow)
+    monkeypatch.setattr(offline_export, "get_image_data", no_download)
+    with pytest.raises(ImportError):
+        write_epub([sample_journal()], str(tmp_path / "book.epub"), embed_images=True, max_image_dimension=800)
+
+
+def test_images_are_yielded_as_they_finish(monkeypatch):
+    started = []
+
+    def get_image_data(url):
+        if url.endswith("/3.jpg"):
+            raise OSError("connection reset")
+        started.append(url)
+        return url.encode("utf-8")
+
+    monkeypatch.setattr(offline_export, "get_image_data", get_image_data)
+    images = [Image(f"/images/{i}.jpg") for i in range(20)] + [Image("/images/0.jpg")]
+    received = []
+    for url, data in offline_export._iter_images(images, max_workers=3):
+        # only the images in flight are held, not the whole journal's
+        assert len(started) - len(received) <= 3
+        received.append(url)
+    assert sorted(received) == sorted(x.url for x in images[:20] if not x.url.endswith("/3.jpg"))
@@ -1,9 +1,30 @@
+import os
+import json
+from datetime import date
+from typing import Optional
+
+import pytest
 from bs4 import BeautifulSoup
 
+import trailjournals_scraping
+from stand_ins import make_entry, make_journal
 from trailjournals_scraping import (
+    Entry,
+    Journal,
+    User,
+    reprocess_failures,
+    discover_journals,
+    journal_entries_url,
     get_images_from_soup,
     format_trailjournals_url,
-    soup_to_text
+    soup_to_text,
+    write_file_atomic,
+    write_files,
+    parse_miles,
+    EntryColumns,
+    EntryMetadata,
+    HtmlCache,
+    prefetch_pages,
 )
 
 
@@ -238,3 +259,313 @@ def test_soup_to_text_with_extra_tags():
         "\n\nAnother paragraph."
         "\n\nYet another paragraph."
     )
+
+
+def test_write_file_atomic_skips_unchanged(tmp_path):
+    path = str(tmp_path / "entry.txt")
+    assert write_file_atomic(path, "some text")
+    assert not write_file_atomic(path, "some text")
+    assert write_file_atomic(path, "some other text")
+    with open(path) as f:
+        assert f.read() == "some other text"
+    assert os.listdir(tmp_path) == ["entry.txt"]  # no temp files left behind
+
+    # same permissions as a file created normally under the process umask
+    with open(tmp_path / "plain.txt", "w") as f:
+        f.write("")
+    assert os.stat(path).st_mode == os.stat(tmp_path / "plain.txt").st_mode
+
+
+def test_write_files_parallel(tmp_path):
+    files = [(str(tmp_path / "journal" / f"{i:02}.txt"), f"entry {i}") for i in range(20)]
+    assert write_files(files, max_workers=4) == 20
+    assert write_files(files, max_workers=4) == 0
+    for path, content in files:
+        with open(path) as f:
+            assert f.read() == content
+
+
+def test_parse_miles():
+    assert parse_miles("12.50") == 12.5
+    assert parse_miles("1,234.5") == 1234.5
+    assert parse_miles(" 8 ") == 8.0
+    assert parse_miles(".5") == 0.5
+    assert parse_miles("") is None
+    assert parse_miles("unknown") is None
+
+    metadata = EntryMetadata(start="Springer Mountain", destination="Hawk Mountain", miles="8.1", trip_miles="")
+    assert metadata.miles_value == 8.1
+    assert metadata.trip_miles_value is None
+
+
+def test_entry_columns_journal_summary(tmp_path):
+    journals = [
+        make_journal([make_entry("Day 1", date(2023, 7, 1), miles="20"), make_entry("Day 2", date(2023, 7, 2))], title="PCT", year="2022"),
+        make_journal([make_entry("Day 1", date(2023, 7, 1), miles="10"), make_entry("Day 3", date(2023, 7, 3), miles="14.5")], title="AT"),
+    ]
+    columns = EntryColumns.from_journals(journals)
+    assert len(columns) == 4
+    summary = columns.journal_summary()
+    assert [x["journal"] for x in summary] == ["2022 PCT", "2023 AT"]
+    assert summary[0]["n_days_with_miles"] == 1
+    assert summary[0]["mean_miles"] == 20.0
+    assert summary[1]["total_miles"] == 24.5
+    assert summary[1]["miles_per_calendar_day"] == 24.5 / 3
+
+    path = str(tmp_path / "miles.csv")
+    columns.to_csv(path)
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert lines[0] == "journal,title,date,miles,trip_miles"
+    assert lines[2] == "2022 PCT,Day 2,2023-07-02,,"
+
+
+def make_columns() -> EntryColumns:
+    def entry(day: Optional[int], miles: str):
+        return make_entry(f"Day {day}", date(2023, 7, day) if day else None, miles=miles)
+
+    return EntryColumns.from_journals([
+        make_journal([], title="Empty", year="2021"),
+        make_journal([entry(4, "20"), entry(None, ""), entry(2, "3")], title="PCT", year="2022"),
+        make_journal([entry(None, "")], title="Undated", year="2022"),
+        make_journal([entry(1, "10"), entry(3, ".5")], title="AT"),
+    ])
+
+
+def test_journal_summary_with_and_without_numpy():
+    pytest.importorskip("numpy")
+    columns = make_columns()
+    assert columns._journal_aggregates_numpy() == columns._journal_aggregates()
+    summary = columns.journal_summary()
+    assert summary[0]["n_entries"] == 0
+    assert summary[1]["first_date"] == date(2023, 7, 2)
+    assert summary[1]["max_miles"] == 20.0
+    assert summary[2]["first_date"] is None
+    assert summary[3]["total_miles"] == 10.5
+
+
+def test_entry_columns_to_numpy_and_parquet(tmp_path):
+    np = pytest.importorskip("numpy")
+    pq = pytest.importorskip("pyarrow.parquet")
+    columns = make_columns()
+    arrays = columns.to_numpy()
+    assert np.isnan(arrays["miles"][1])
+    assert arrays["miles"][0] == 20.0
+    assert np.isnat(arrays["date"][1])
+
+    path = str(tmp_path / "miles.parquet")
+    columns.to_parquet(path)
+    table = pq.read_table(path).to_pydict()
+    assert table["miles"] == [20.0, None, 3.0, None, 10.0, 0.5]
+    assert table["date"][0] == date(2023, 7, 4)
+
+
+def test_journal_entries_url():
+    expected = "https://www.trailjournals.com/journal/entries/12345"
+    assert journal_entries_url("/journal/12345") == expected
+    assert journal_entries_url(expected) == expected
+
+
+def test_user_discovery_is_cached(tmp_path, monkeypatch):
+    pages = {
+        "https://www.trailjournals.com/hiker": """
+            <li class="other-journals"><a href="/journal/others/1">Other Journals</a></li>
+        """,
+        "https://www.trailjournals.com/journal/others/1": """
+            <div class="media-body"><a class="btn-primary" href="/journal/2">2023</a></div>
+            <div class="media-body"><a class="btn-primary" href="/journal/1">2022</a></div>
+        """,
+    }
+    requested = []
+
+    def fake_fetch_html(url: str) -> str:
+        requested.append(url)
+        return pages[url]
+
+    monkeypatch.setenv("DISCOVERY_CACHE", str(tmp_path / "cache.json"))
+    monkeypatch.setattr(trailjournals_scraping, "get_html", fake_fetch_html)
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", fake_fetch_html)
+
+    url, journal_urls = discover_journals("hiker")
+    assert url == "https://www.trailjournals.com/journal/others/1"
+    assert journal_urls == [
+        "https://www.trailjournals.com/journal/1",
+        "https://www.trailjournals.com/journal/2",
+    ]
+    assert len(requested) == 2
+
+    assert discover_journals("hiker") == (url, journal_urls)
+    assert len(requested) == 2  # served from the cache
+
+    discover_journals("hiker", refresh=True)
+    assert requested[2:] == [url]  # the "Other Journals" URL is still reused
+
+
+def test_entry_from_html(entry_html):
+    entry = Entry("/entry/1", html=entry_html)
+    assert entry.title == "Day 1"
+    assert entry.date == "Saturday, July 8th, 2023"
+    assert entry.entry_date == date(2023, 7, 8)
+    assert entry.metadata.start == "Springer Mountain"
+    assert entry.metadata.miles_value == 8.1
+    assert entry.text == "Off we go."
+    assert entry.errors == {}
+    assert entry.raw_html is None
+
+
+def test_entry_parse_failures_are_isolated(tmp_path, entry_html):
+    html = entry_html.replace("entry-title", "something-else").replace("July 08, 2023", "8 July 2023")
+    with pytest.raises(AttributeError):
+        Entry("/entry/1", html=html)
+
+    entry = Entry("/entry/1", html=html, strict=False)
+    assert set(entry.errors) == {"title", "date"}
+    assert entry.title == ""
+    assert entry.date == ""
+    assert entry.text == "Off we go."  # the other fields are still extracted
+    assert entry.raw_html == html
+
+    # reprocess the stored HTML once it's fixed, without the network
+    entry.raw_html = entry_html
+    assert entry.reprocess()
+    assert entry.title == "Day 1"
+
+    directory = tmp_path / "failures"
+    directory.mkdir()
+    for i, h in enumerate([html, entry_html]):
+        with open(directory / f"entry_{i}.json", "w") as f:
+            json.dump({"url": f"/entry/{i}", "journal": None, "errors": {}, "html": h}, f)
+    entries = reprocess_failures(str(directory))
+    assert [bool(x.errors) for x in entries] == [True, False]
+    assert os.listdir(directory) == ["entry_0.json"]
+
+
+def test_entry_releases_soup_after_extraction(entry_html):
+    entry = Entry("/entry/1", html=entry_html)
+    assert entry._soup is None
+    assert entry.text == "Off we go."
+
+    entry = Entry("/entry/1", html=entry_html.replace("entry-title", "something-else"), strict=False)
+    assert entry._soup is None
+    assert entry.reprocess() is False
+
+
+def test_html_cache_is_bounded_by_bytes():
+    page = "x" * 1000
+    cache = HtmlCache(max_bytes=3 * len(page) + 200)
+    for i in range(3):
+        cache.put((str(i),), page)
+    assert cache.get(("0",)) == page  # now the most recently used
+    cache.put(("3",), page)
+    assert cache.get(("1",)) is None
+    assert len(cache) == 3
+    assert cache.n_bytes <= cache.max_bytes
+    cache.put(("huge",), "x" * 10_000)  # larger than the whole cache, not stored
+    assert cache.get(("huge",)) is None
+
+
+def test_prefetch_stops_when_cache_is_full(monkeypatch):
+    cache = HtmlCache(max_bytes=5000)
+    requested = []
+
+    def fake_fetch_html(url):
+        requested.append(url)
+        return "x" * 1000
+
+    monkeypatch.setattr(trailjournals_scraping, "html_cache", cache)
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", fake_fetch_html)
+    prefetch_pages([f"/journal/entries/{i}" for i in range(20)], max_workers=2)
+    assert len(requested) < 20
+    assert cache.n_bytes <= cache.max_bytes
+
+
+def test_failed_entries_are_isolated(tmp_path, monkeypatch, entry_html):
+    pages = {
+        "https://www.trailjournals.com/journal/entries/1": """
+            <h1 class="journal-title">Hiker 2023<br/>Appalachian Trail 2023</h1>
+            <table>
+              <tr><td><a href="/entry/1">Day 1</a></td></tr>
+              <tr><td><a href="/entry/2">Day 2</a></td></tr>
+            </table>
+        """,
+        "https://www.trailjournals.com/entry/1": entry_html,
+        "https://www.trailjournals.com/entry/2": entry_html.replace("Day 1", "Day 2"),
+    }
+    broken = {"https://www.trailjournals.com/entry/1"}
+
+    def fake_fetch_html(url: str) -> str:
+        if url in broken:
+            raise trailjournals_scraping.requests.HTTPError("500")
+        return pages[url]
+
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", fake_fetch_html)
+    with pytest.raises(trailjournals_scraping.requests.HTTPError):
+        Journal("/journal/1")
+
+    journal = Journal("/journal/1", strict=False)
+    assert [x.title for x in journal.entries] == ["Day 2"]
+    assert list(journal.entry_errors) == ["https://www.trailjournals.com/entry/1"]
+    assert journal.errors == {}
+    assert not journal.reprocess()  # loading the entry needs the network
+
+    broken.clear()
+    assert journal.retry_failed_entries()
+    assert [x.title for x in journal.entries] == ["Day 1", "Day 2"]
+    assert journal.entry_errors == {}
+
+
+def test_user_discovery_failures_are_isolated(tmp_path, monkeypatch):
+    pages = {
+        "https://www.trailjournals.com/hiker": "<p>not a journal page</p>",
+    }
+    monkeypatch.setenv("DISCOVERY_CACHE", str(tmp_path / "cache.json"))
+    monkeypatch.setattr(trailjournals_scraping, "get_html", lambda url: pages[url])
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", lambda url: pages[url])
+    with pytest.raises(AttributeError):
+        User("hiker")
+    user = User("hiker", strict=False)
+    assert user.journals == []
+    assert set(user.errors) == {"journals"}
+
+    pages["https://www.trailjournals.com/hiker"] = """
+        <li class="other-journals"><a href="/journal/others/1">Other Journals</a></li>
+    """
+    pages["https://www.trailjournals.com/journal/others/1"] = """
+        <div class="media-body"><a class="btn-primary" href="/journal/2">2023</a></div>
+        <div class="media-body"><span>no link</span></div>
+    """
+    pages["https://www.trailjournals.com/journal/entries/2"] = "<p>missing title</p><table></table>"
+    user = User("hiker", strict=False, refresh=True)
+    assert set(user.errors) == {"journals[0]"}  # the journal without a link
+    assert [x.url for x in user.journals] == ["https://www.trailjournals.com/journal/entries/2"]
+    assert set(user.journals[0].errors) == {"title", "year"}
+
+    # the list with the skipped journal isn't cached, so the fixed page is picked up
+    pages["https://www.trailjournals.com/journal/others/1"] = """
+        <div class="media-body"><a class="btn-primary" href="/journal/2">2023</a></div>
+        <div class="media-body"><a class="btn-primary" href="/journal/1">2022</a></div>
+    """
+    pages["https://www.trailjournals.com/journal/entries/1"] = "<p>missing title</p><table></table>"
+    user = User("hiker", strict=False)
+    assert user.errors == {}
+    assert [x.url for x in user.journals] == [
+        "https://www.trailjournals.com/journal/entries/1",
+        "https://www.trailjournals.com/journal/entries/2",
+    ]
+
+
+def test_pages_read_once_are_not_kept_in_the_cache(monkeypatch, entry_html):
+    cache = HtmlCache(max_bytes=100_000)
+    monkeypatch.setattr(trailjournals_scraping, "html_cache", cache)
+    monkeypatch.setattr(trailjournals_scraping, "fetch_html", lambda url: entry_html)
+    Entry("/entry/1")
+    assert len(cache) == 0
+
+    prefetch_pages(["/entry/1", "/entry/2"], max_workers=2)
+    assert len(cache) == 2
+    Entry("/entry/1")  # the prefetched copy is used and dropped
+    assert len(cache) == 1
+    assert cache.n_bytes < 100_000
+
+    monkeypatch.setenv("MEMORY_BUDGET_MB", "1")
+    assert HtmlCache().max_bytes == 512 * 1024  # read when used, not at import
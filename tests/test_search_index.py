@@ -0,0 +1,65 @@
+from types import SimpleNamespace
+
+from search_index import SearchIndex, tokenize
+from stand_ins import make_entry, make_journal
+
+
+URL = "https://www.trailjournals.com"
+JOURNAL = make_journal(user=SimpleNamespace(username="hiker"))
+
+
+def entry(path: str, title: str, text: str, start: str = ""):
+    return make_entry(title, text=text, start=start, url=path, journal=JOURNAL)
+
+
+def test_tokenize():
+    assert tokenize("Stayed at Blood Mountain shelter, didn't sleep.") == [
+        "stayed", "at", "blood", "mountain", "shelter", "didn't", "sleep",
+    ]
+    assert tokenize(None) == []
+    assert tokenize("Didn\u2019t stop at the café_") == ["didn't", "stop", "at", "the", "café"]
+
+
+def test_search_ranks_and_updates(tmp_path):
+    index = SearchIndex()
+    assert index.add_entry(entry("/1", "Day 1", "Rain all day.", start="Springer Mountain"))
+    assert index.add_entry(entry("/2", "Day 2", "Hiked past Blood Mountain to the shelter."))
+    assert index.add_entry(entry("/3", "Zero day", "Rested in town."))
+    assert not index.add_entry(entry("/3", "Zero day", "Rested in town."))
+
+    hits = index.search("mountain")
+    assert [x.url for x in hits] == [URL + "/1", URL + "/2"]  # place name match outranks body match
+    assert hits[0].journal == "Appalachian Trail"
+    assert hits[0].username == "hiker"
+
+    # changed entries replace the old version
+    assert index.add_entry(entry("/3", "Zero day", "Rested in town below the mountain."))
+    assert index.n_documents == 3
+    assert [x.url for x in index.search("rested")] == [URL + "/3"]
+
+    path = str(tmp_path / "index.json.gz")
+    index.save(path)
+    loaded = SearchIndex.load(path)
+    assert loaded.n_documents == 3
+    assert [x.url for x in loaded.search("mountain")] == [x.url for x in index.search("mountain")]
+    assert loaded.search("nothing matches") == []
+
+
+def test_replaced_documents_dont_count_towards_idf():
+    index = SearchIndex()
+    index.add_entry(entry("/1", "Day 1", "Rain."))
+    index.add_entry(entry("/2", "Day 2", "Rain, then sun."))
+    fresh = SearchIndex()
+    fresh.add_entry(entry("/1", "Day 1", "Rain."))
+    fresh.add_entry(entry("/2", "Day 2", "Sun all day."))
+
+    index.add_entry(entry("/2", "Day 2", "Sun all day."))  # replaced, not yet compacted
+    assert [(x.url, x.score) for x in index.search("rain")] == [(x.url, x.score) for x in fresh.search("rain")]
+
+
+def test_curly_apostrophes_match_straight_ones():
+    index = SearchIndex()
+    index.add_entry(entry("/1", "Day 1", "Didn\u2019t make it to the café in Hot Springs."))
+    index.add_entry(entry("/2", "Day 2", "Didn t rain."))
+    assert [x.url for x in index.search("didn't")] == [URL + "/1"]
+    assert [x.url for x in index.search("café")] == [URL + "/1"]
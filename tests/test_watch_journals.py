@@ -0,0 +1,164 @@
+from types import SimpleNamespace
+
+import requests
+
+import trailjournals_scraping
+import watch_journals
+from watch_journals import HostBudget, JournalWatcher
+
+
+def make_index(entry_ids):
+    links = "".join([f'<tr><td><a href="/entry/{x}">Entry {x}</a></td></tr>' for x in entry_ids])
+    return f"<table>{links}</table>"
+
+
+def test_host_budget_waits_when_exhausted():
+    now = [0.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    budget = HostBudget(requests_per_minute=2, clock=lambda: now[0], sleep=sleep)
+    budget.acquire("https://www.trailjournals.com/a")
+    budget.acquire("https://www.trailjournals.com/b")
+    assert waits == []
+    budget.acquire("https://www.trailjournals.com/c")
+    assert waits == [30.0]
+    budget.acquire("https://example.com/other-host")
+    assert waits == [30.0]
+
+
+def test_watcher_emits_only_new_entries(tmp_path, monkeypatch):
+    index = {"entries": [1, 2]}
+    monkeypatch.setattr(watch_journals, "discover_journals", lambda username, refresh: ("", ["/journal/10"]))
+    monkeypatch.setattr(watch_journals, "fetch_html", lambda url: make_index(index["entries"]))
+    monkeypatch.setattr(watch_journals, "Entry", lambda url, strict: SimpleNamespace(url=url, title=url))
+
+    now = [0.0]
+    emitted = []
+    state_path = str(tmp_path / "state.json")
+
+    def make_watcher():
+        return JournalWatcher(
+            ["hiker"],
+            on_entry=lambda username, journal_url, entry: emitted.append(entry.url),
+            state_path=state_path,
+            min_interval=60,
+            max_interval=240,
+            clock=lambda: now[0],
+            sleep=lambda seconds: None,
+        )
+
+    watcher = make_watcher()
+    assert watcher.poll_once() == 0  # existing entries are only recorded as seen
+    journal = watcher.journals["https://www.trailjournals.com/journal/entries/10"]
+    assert journal.interval == 120
+
+    index["entries"] = [1, 2, 3]
+    now[0] = 60
+    assert watcher.poll_once() == 0  # not due yet
+    now[0] = 120
+    assert watcher.poll_once() == 1
+    assert emitted == ["https://www.trailjournals.com/entry/3"]
+    assert journal.interval == 60
+
+    for expected in [120, 240, 240]:
+        now[0] = journal.next_poll
+        watcher.poll_once()
+        assert journal.interval == expected
+
+    # state survives a restart
+    index["entries"] = [1, 2, 3, 4]
+    now[0] = journal.next_poll
+    assert make_watcher().poll_once() == 1
+    assert emitted[-1] == "https://www.trailjournals.com/entry/4"
+
+
+def test_watcher_backs_off_after_failures(tmp_path, monkeypatch):
+    def broken_discovery(username, refresh):
+        raise AttributeError("'NoneType' object has no attribute 'find'")
+
+    monkeypatch.setattr(watch_journals, "discover_journals", broken_discovery)
+    now = [0.0]
+    watcher = JournalWatcher(
+        ["hiker"], state_path=str(tmp_path / "state.json"), min_interval=60, clock=lambda: now[0], sleep=lambda s: None,
+    )
+    assert watcher.poll_once() == 0
+    assert watcher.seconds_until_next_poll() == 60
+
+    # a failed first poll doesn't seed the journal, so its history isn't emitted later
+    index = {"html": None}
+
+    def fetch_html(url):
+        if index["html"] is None:
+            raise requests.ConnectionError("down")
+        return index["html"]
+
+    emitted = []
+    monkeypatch.setattr(watch_journals, "discover_journals", lambda username, refresh: ("", ["/journal/10"]))
+    monkeypatch.setattr(watch_journals, "fetch_html", fetch_html)
+    monkeypatch.setattr(watch_journals, "Entry", lambda url, strict: SimpleNamespace(url=url, title=url))
+    watcher.on_entry = lambda username, journal_url, entry: emitted.append(entry.url)
+    now[0] = 60
+    watcher.poll_once()
+    journal = watcher.journals["https://www.trailjournals.com/journal/entries/10"]
+    assert not journal.seeded
+
+    index["html"] = make_index([1, 2])
+    now[0] = journal.next_poll
+    assert watcher.poll_once() == 0
+    assert journal.seeded and emitted == []
+    index["html"] = make_index([1, 2, 3])
+    now[0] = journal.next_poll
+    assert watcher.poll_once() == 1
+
+
+def test_every_request_goes_through_the_budget(tmp_path, monkeypatch):
+    pages = {
+        "https://www.trailjournals.com/hiker": '<li class="other-journals"><a href="/journal/others/1">Other</a></li>',
+        "https://www.trailjournals.com/journal/others/1": '<div class="media-body"><a class="btn-primary" href="/journal/10">2023</a></div>',
+        "https://www.trailjournals.com/journal/entries/10": make_index([1]),
+    }
+
+    class Response:
+        def __init__(self, url):
+            self.status_code = 200
+            self.text = pages[url]
+            self.content = self.text.encode("utf-8")
+
+        def raise_for_status(self):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc_info):
+            pass
+
+    monkeypatch.setenv("DISCOVERY_CACHE", str(tmp_path / "cache.json"))
+    monkeypatch.setattr(trailjournals_scraping.requests, "get", lambda url, **kwargs: Response(url))
+    now = [1000.0]
+    waits = []
+
+    def sleep(seconds):
+        waits.append(seconds)
+        now[0] += seconds
+
+    watcher = JournalWatcher(
+        ["hiker"],
+        state_path=str(tmp_path / "state.json"),
+        min_interval=60,
+        requests_per_minute=2,
+        clock=lambda: now[0],
+        sleep=sleep,
+    )
+    # discovery makes two requests and seeding the journal a third, which has to wait
+    watcher.poll_once()
+    assert waits == [30.0]
+
+    # the budget runs on the watcher's clock, so it has refilled by the next poll
+    now[0] += 120
+    watcher.poll_once()
+    assert waits == [30.0]
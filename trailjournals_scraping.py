@@ -1,15 +1,28 @@
+import io
 import os
 import re
+import csv
 import json
+import math
 import string
-from dataclasses import dataclass
-from datetime import datetime
-from functools import lru_cache
-from typing import List
+import hashlib
+import sys
+import time
+import argparse
+import threading
+from array import array
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Tuple, Union
 
 from bs4 import BeautifulSoup, Tag
 import requests
 
+import crawl_profiler
+
 import logging
 logger = logging.getLogger(__name__)
 
@@ -18,24 +31,69 @@ load_dotenv()
 
 
 class Entry:
-    def __init__(self, url: str, journal: "Journal" = None):
+    def __init__(
+            self,
+            url: str,
+            journal: "Journal" = None,
+            strict: bool = True,
+            html: str = None,
+            archive: "HtmlArchive" = None,
+            offline: bool = False,
+    ):
+        """
+        If `strict` is False, a field that can't be extracted is set to an empty value and
+        the error is recorded in `self.errors` instead of raising, and the page's HTML is
+        kept in `self.raw_html` so the entry can be reprocessed later without refetching it.
+        Pass `html` to build the entry from already fetched HTML. See `load_html` for
+        `archive` and `offline`.
+        """
         self.journal = journal
         self.url = format_trailjournals_url(url)
-        self._soup = get_soup(self.url)
-        self.title = self._get_title()
-        self.date = self._get_date()
-        self.metadata = self._get_metadata()
-        self.text = self._get_text()
-        self.images = self._get_images()
+        self.strict = strict
+        if html is None:
+            html = load_html(self.url, archive=archive, offline=offline, cache=False)
+        self.raw_html = html
+        self._extract_fields()
+
+    def _extract_fields(self):
+        self.errors: Dict[str, str] = {}
+        with crawl_profiler.track_parse(self.url):
+            self._soup = BeautifulSoup(self.raw_html, "html.parser")
+        try:
+            self.title = extract_field(self, "title", self._get_title, "")
+            self.entry_date = extract_field(self, "date", self._get_entry_date, None)
+            self.date = self._format_entry_date(self.entry_date) if self.entry_date else ""
+            self.metadata = extract_field(self, "metadata", self._get_metadata, EntryMetadata("", "", "", ""))
+            self.text = extract_field(self, "text", self._get_text, "")
+            self.images = extract_field(self, "images", self._get_images, [])
+        finally:
+            release_soup(self)
+        crawl_profiler.mark(self.url, "extracted")
+        if not self.errors:
+            self.raw_html = None  # only kept for entries that need reprocessing
+
+    def reprocess(self) -> bool:
+        """Re-run the field extractors over the stored HTML. Return True if every field was extracted."""
+        if self.raw_html is None:
+            raise ValueError(f"no stored HTML to reprocess for {self.url}")
+        self._extract_fields()
+        return not self.errors
+
+    def to_failure_record(self) -> dict:
+        return {
+            "url": self.url,
+            "journal": self.journal.title if self.journal is not None else None,
+            "errors": self.errors,
+            "html": self.raw_html,
+        }
 
     def _get_title(self) -> str:
         return self._soup.find("h2", {"class": "entry-title"}).text.strip()
 
-    def _get_date(self) -> str:
+    def _get_entry_date(self) -> date:
         # format is "Saturday, July 08, 2023"
         d = self._soup.find("div", {"class": "entry-date"}).text.strip()
-        d = datetime.strptime(d, "%A, %B %d, %Y")
-        return self._format_entry_date(d)
+        return datetime.strptime(d, "%A, %B %d, %Y").date()
 
     def _get_metadata(self) -> "EntryMetadata":
         metadata_left = self._soup.find_all("div", {"class": "entry-text"})
@@ -60,7 +118,7 @@ class Entry:
         )
 
     @staticmethod
-    def _format_entry_date(d: datetime) -> str:
+    def _format_entry_date(d: date) -> str:
         """
         Format the date as, e.g., "Saturday, July 8th, 2023".
 
@@ -70,7 +128,7 @@ class Entry:
         def suffix(day: int):
             return {1: "st", 2: "nd", 3: "rd"}.get(day % 20, "th")
 
-        def custom_strftime(fmt: str, d: datetime) -> str:
+        def custom_strftime(fmt: str, d: date) -> str:
             return d.strftime(fmt).replace("{S}", f"{d.day}{suffix(d.day)}")
 
         return custom_strftime("%A, %B {S}, %Y", d)
@@ -89,8 +147,8 @@ class Entry:
             "title": self.title,
             "date": self.date,
             "text": self.text,
-            "image_urls": self.images,
-            "image_names": [x.split("/")[-1] for x in self.images],
+            "image_urls": [x.url for x in self.images],
+            "image_names": [x.url.split("/")[-1] for x in self.images],
         }
 
     def to_text(self) -> str:
@@ -103,10 +161,23 @@ class Entry:
         self._write_entry_to_file(path, "text")
 
     def _write_entry_to_file(self, path: str, method: str):
+        path = self._format_file_path(path, method)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        logger.debug(f"writing entry to {path}")
+        write_file_atomic(path, self._serialize(method))
+
+    def _serialize(self, method: str) -> str:
+        if method == "json":
+            return json.dumps(self.to_dict(), indent=4)
+        elif method == "text":
+            return self.to_text()
+        raise ValueError(f"method must be 'json' or 'text', not {method}")
+
+    @staticmethod
+    def _format_file_path(path: str, method: str) -> str:
         if method not in ["json", "text"]:
             raise ValueError(f"method must be 'json' or 'text', not {method}")
 
-        os.makedirs(os.path.dirname(path), exist_ok=True)
         suffix = ".json" if method == "json" else ".txt"
         if not path.endswith(suffix):
             path = f"{path}{suffix}"
@@ -117,15 +188,7 @@ class Entry:
         for char in [x for x in string.punctuation if x != "_"]:
             file_name = file_name.replace(char, "")
         file_name = f"{file_name}{suffix}"  # add file extension back
-        path = os.path.join(os.path.dirname(path), file_name)
-
-        logger.debug(f"writing entry to {path}")
-        if method == "json":
-            with open(path, "w") as f:
-                json.dump(self.to_dict(), f, indent=4)
-        elif method == "text":
-            with open(path, "w") as f:
-                f.write(self.to_text())
+        return os.path.join(os.path.dirname(path), file_name)
 
     def download_images(self, directory: str):
         os.makedirs(directory, exist_ok=True)
@@ -191,21 +254,267 @@ class EntryMetadata:
     destination: str
     miles: str
     trip_miles: str
+    # numeric versions of `miles` and `trip_miles` (None if missing or unparseable)
+    miles_value: Optional[float] = field(init=False, default=None)
+    trip_miles_value: Optional[float] = field(init=False, default=None)
+
+    def __post_init__(self):
+        self.miles_value = parse_miles(self.miles)
+        self.trip_miles_value = parse_miles(self.trip_miles)
 
     def __bool__(self):
         return any([self.start, self.destination, self.miles, self.trip_miles])
 
 
+def parse_miles(s: str) -> Optional[float]:
+    """Parse a mileage string like "12.50" or "1,234.5" into a float."""
+    match = re.search(r"-?\d*\.?\d+", s.replace(",", "")) if s else None
+    return float(match.group()) if match else None
+
+
+@dataclass
+class EntryColumns:
+    """
+    Column-oriented view of entry data for analysis. Mileage columns are float arrays
+    (missing values are stored as 0.0 and flagged in the `has_miles`/`has_trip_miles`
+    masks), and entries of each journal are stored contiguously, so per-journal
+    aggregates can be computed over each journal's segment of the arrays at once (with
+    NumPy's `reduceat` when numpy is installed).
+    """
+    journal: List[str]
+    title: List[str]
+    date: List[Optional[date]]
+    miles: array
+    has_miles: array
+    trip_miles: array
+    has_trip_miles: array
+    # (journal label, start index, stop index) for each journal
+    journal_slices: List[Tuple[str, int, int]]
+
+    @classmethod
+    def from_journals(cls, journals: List["Journal"]) -> "EntryColumns":
+        columns = cls(
+            journal=[], title=[], date=[],
+            miles=array("d"), has_miles=array("b"),
+            trip_miles=array("d"), has_trip_miles=array("b"),
+            journal_slices=[],
+        )
+        for journal in journals:
+            label = f"{journal.year} {journal.title}"
+            start = len(columns)
+            for entry in journal.entries:
+                columns.journal.append(label)
+                columns.title.append(entry.title)
+                columns.date.append(entry.entry_date)
+                miles = entry.metadata.miles_value
+                trip_miles = entry.metadata.trip_miles_value
+                columns.miles.append(miles or 0.0)
+                columns.has_miles.append(miles is not None)
+                columns.trip_miles.append(trip_miles or 0.0)
+                columns.has_trip_miles.append(trip_miles is not None)
+            columns.journal_slices.append((label, start, len(columns)))
+        return columns
+
+    def journal_summary(self) -> List[dict]:
+        """Mileage and pace per journal. Uses numpy if it's installed."""
+        try:
+            aggregates = self._journal_aggregates_numpy()
+        except ImportError:
+            aggregates = self._journal_aggregates()
+
+        summary = []
+        for (label, start, stop), (n_days, total_miles, max_miles, first_date, last_date) in zip(
+                self.journal_slices, aggregates
+        ):
+            n_calendar_days = (last_date - first_date).days + 1 if first_date else 0
+            summary.append({
+                "journal": label,
+                "n_entries": stop - start,
+                "n_days_with_miles": n_days,
+                "total_miles": total_miles,
+                "max_miles": max_miles,
+                "mean_miles": total_miles / n_days if n_days else None,
+                "first_date": first_date,
+                "last_date": last_date,
+                "miles_per_calendar_day": total_miles / n_calendar_days if n_calendar_days else None,
+            })
+        return summary
+
+    def _journal_aggregates(self) -> List[tuple]:
+        """(days with miles, total miles, max miles, first date, last date) per journal, without numpy."""
+        aggregates = []
+        for _, start, stop in self.journal_slices:
+            dates = [x for x in self.date[start:stop] if x is not None]
+            aggregates.append((
+                sum(self.has_miles[start:stop]),
+                math.fsum(self.miles[start:stop]),
+                max(self.miles[start:stop]) if stop > start else 0.0,
+                min(dates) if dates else None,
+                max(dates) if dates else None,
+            ))
+        return aggregates
+
+    def _journal_aggregates_numpy(self) -> List[tuple]:
+        """Same as `_journal_aggregates`, computed for all journals at once with `reduceat`."""
+        import numpy as np
+
+        n_journals = len(self.journal_slices)
+        starts = np.array([x[1] for x in self.journal_slices], dtype=np.intp)
+        stops = np.array([x[2] for x in self.journal_slices], dtype=np.intp)
+        # reduceat can't reduce empty segments, but journals are contiguous, so skipping the
+        # empty ones leaves every other segment running exactly to the next start
+        nonempty = stops > starts
+        n_days = np.zeros(n_journals, dtype=np.int64)
+        total_miles = np.zeros(n_journals)
+        max_miles = np.zeros(n_journals)
+        first_days = np.full(n_journals, np.iinfo(np.int64).max)
+        last_days = np.full(n_journals, np.iinfo(np.int64).min)
+        if nonempty.any():
+            columns = self.to_numpy()
+            index = starts[nonempty]
+            miles = np.frombuffer(self.miles, dtype=np.float64)
+            n_days[nonempty] = np.add.reduceat(np.frombuffer(self.has_miles, dtype=np.int8).astype(np.int64), index)
+            total_miles[nonempty] = np.add.reduceat(miles, index)
+            max_miles[nonempty] = np.maximum.reduceat(miles, index)
+            missing = np.isnat(columns["date"])
+            days = columns["date"].astype(np.int64)
+            first_days[nonempty] = np.minimum.reduceat(np.where(missing, first_days[0], days), index)
+            last_days[nonempty] = np.maximum.reduceat(np.where(missing, last_days[0], days), index)
+
+        def to_date(day: int) -> Optional[date]:
+            if day in (np.iinfo(np.int64).max, np.iinfo(np.int64).min):
+                return None
+            return np.datetime64(int(day), "D").item()
+
+        return [
+            (int(n_days[i]), float(total_miles[i]), float(max_miles[i]), to_date(first_days[i]), to_date(last_days[i]))
+            for i in range(n_journals)
+        ]
+
+    def to_numpy(self) -> dict:
+        """Return the columns as NumPy arrays (missing mileage becomes NaN). Requires numpy."""
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ImportError("EntryColumns.to_numpy requires numpy (`pip install numpy`)") from e
+
+        miles = np.frombuffer(self.miles, dtype=np.float64).copy()
+        miles[~np.frombuffer(self.has_miles, dtype=np.int8).astype(bool)] = np.nan
+        trip_miles = np.frombuffer(self.trip_miles, dtype=np.float64).copy()
+        trip_miles[~np.frombuffer(self.has_trip_miles, dtype=np.int8).astype(bool)] = np.nan
+        return {
+            "journal": np.array(self.journal, dtype=object),
+            "title": np.array(self.title, dtype=object),
+            "date": np.array([x or "NaT" for x in self.date], dtype="datetime64[D]"),
+            "miles": miles,
+            "trip_miles": trip_miles,
+        }
+
+    def _rows(self):
+        for i in range(len(self)):
+            yield {
+                "journal": self.journal[i],
+                "title": self.title[i],
+                "date": self.date[i].isoformat() if self.date[i] else None,
+                "miles": self.miles[i] if self.has_miles[i] else None,
+                "trip_miles": self.trip_miles[i] if self.has_trip_miles[i] else None,
+            }
+
+    def to_csv(self, path: str):
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=["journal", "title", "date", "miles", "trip_miles"])
+        writer.writeheader()
+        writer.writerows(self._rows())
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        write_file_atomic(path, buffer.getvalue())
+
+    def to_parquet(self, path: str):
+        """Write the columns to a Parquet file. Requires pyarrow."""
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("EntryColumns.to_parquet requires pyarrow (`pip install pyarrow`)") from e
+
+        table = pa.table({
+            "journal": self.journal,
+            "title": self.title,
+            "date": pa.array(self.date, type=pa.date32()),
+            "miles": pa.array(self.miles, mask=[not x for x in self.has_miles], type=pa.float64()),
+            "trip_miles": pa.array(self.trip_miles, mask=[not x for x in self.has_trip_miles], type=pa.float64()),
+        })
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        pq.write_table(table, path)
+
+    def __len__(self):
+        return len(self.title)
+
+
 class Journal:
-    def __init__(self, url: str, user: "User" = None):
+    def __init__(
+            self,
+            url: str,
+            user: "User" = None,
+            strict: bool = True,
+            archive: "HtmlArchive" = None,
+            offline: bool = False,
+    ):
+        """See `Entry` for `strict`, `archive` and `offline`, which are passed on to every entry."""
         self.user = user
         self._initial_url = format_trailjournals_url(url)
         # this is the meaningful URL with the list of entries
-        self.url = self._initial_url.replace("journal/", "journal/entries/")
-        self._soup = get_soup(self.url)
-        self.title = self._get_title()
-        self.year = self._get_year()
+        self.url = journal_entries_url(self._initial_url)
+        self.strict = strict
+        self.archive = archive
+        self.offline = offline
+        self.raw_html = load_html(self.url, archive=archive, offline=offline, cache=False)
+        self._extract_fields()
+        # entries that failed to load (e.g., the request failed), by URL
+        self.entry_errors: Dict[str, str] = {}
         self.entries = self._get_entries()
+        if not self.errors:
+            self.raw_html = None
+
+    def _extract_fields(self):
+        self.errors: Dict[str, str] = {}
+        with crawl_profiler.track_parse(self.url):
+            self._soup = BeautifulSoup(self.raw_html, "html.parser")
+        try:
+            self.title = extract_field(self, "title", self._get_title, "")
+            self.year = extract_field(self, "year", self._get_year, "")
+            self._entry_urls = extract_field(self, "entries", self._get_entry_urls, [])
+        finally:
+            # released before the entries are processed, so only one page's tree is alive at a time
+            release_soup(self)
+        crawl_profiler.mark(self.url, "extracted")
+
+    def reprocess(self) -> bool:
+        """
+        Re-run the title and year extractors over the stored HTML and reprocess the entries
+        that had errors. Return True if everything was extracted and every entry is loaded.
+        """
+        if self.raw_html is not None:
+            entries_error = self.errors.get("entries")
+            self._extract_fields()
+            if entries_error and "entries" not in self.errors:
+                # the entry URLs are known now, but loading them needs the network (see `retry_failed_entries`)
+                self.entry_errors.update({x: entries_error for x in self._entry_urls})
+            if not self.errors:
+                self.raw_html = None
+        entries_ok = all([entry.reprocess() for entry in self.entries if entry.errors])
+        return not self.errors and not self.entry_errors and entries_ok
+
+    def retry_failed_entries(self) -> bool:
+        """Load the entries that failed to load again (this uses the network). Return True if they all loaded."""
+        failed_urls = list(self.entry_errors)
+        self.entry_errors = {}
+        entries = {x.url: x for x in self.entries}
+        for url in failed_urls:
+            entry = self._load_entry(url)
+            if entry is not None:
+                entries[url] = entry
+        self.entries = [entries[x] for x in self._entry_urls if x in entries]
+        return not self.entry_errors
 
     def _get_title(self) -> str:
         title_contents = self._soup.find("h1", {"class": "journal-title"}).contents
@@ -219,29 +528,62 @@ class Journal:
         logger.debug(f"found journal year: {year}")
         return year
 
-    def _get_entries(self) -> List[Entry]:
-        logger.info(f"processing entries for {self.title}")
-        table = self._soup.find("table")
-        entry_urls = [x["href"] for x in table.find_all("a")]
+    def _get_entry_urls(self) -> List[str]:
+        entry_urls = get_entry_urls_from_soup(self._soup)
         logger.info(f"found {len(entry_urls)} entries")
-        entries = [Entry(x, journal=self) for x in entry_urls]
-        return entries
-
-    def write_all_entries_to_json(self, directory: str):
-        self._write_all_entries(directory, method="json")
+        return entry_urls
 
-    def write_all_entries_to_text(self, directory: str):
-        self._write_all_entries(directory, method="text")
+    def _get_entries(self) -> List[Entry]:
+        logger.info(f"processing entries for {self.title}")
+        entries = [self._load_entry(x) for x in self._entry_urls]
+        return [x for x in entries if x is not None]
 
-    def _write_all_entries(self, directory: str, method: str):
+    def _load_entry(self, url: str) -> Optional[Entry]:
+        """
+        Load one entry. If `self.strict` is False, a failure is recorded in `self.entry_errors`
+        and None is returned, so one bad entry doesn't discard the rest of the journal.
+        """
+        try:
+            return Entry(url, journal=self, strict=self.strict, archive=self.archive, offline=self.offline)
+        except Exception as e:
+            if self.strict:
+                raise
+            logger.warning(f"failed to load entry {url}: {e!r}")
+            self.entry_errors[url] = repr(e)
+            return None
+
+    def write_all_entries_to_json(self, directory: str, max_workers: int = None):
+        self._write_all_entries(directory, method="json", max_workers=max_workers)
+
+    def write_all_entries_to_text(self, directory: str, max_workers: int = None):
+        self._write_all_entries(directory, method="text", max_workers=max_workers)
+
+    def _write_all_entries(self, directory: str, method: str, max_workers: int = None):
+        write_files(self._entry_files(directory, method), max_workers=max_workers)
+
+    def _entry_files(self, directory: str, method: str) -> List[Tuple[str, str]]:
+        """Serialize all entries in memory and return a list of (path, content) pairs."""
         logger.info(f"writing {self.title} journal entries ({self.n_entries} total) to {method} in {directory}")
         n_digits = min(2, len(str(self.n_entries)))
+        files = []
         for i, entry in enumerate(self.entries):
             # format the entry number with leading zeros
             entry_number = str(i + 1).zfill(n_digits)
             name = f"{entry_number}_{replace_spaces_and_dashes(entry.title)}"
-            path = os.path.join(directory, name)
-            entry._write_entry_to_file(path=path, method=method)
+            path = entry._format_file_path(os.path.join(directory, name), method)
+            files.append((path, entry._serialize(method)))
+        return files
+
+    def to_columns(self) -> EntryColumns:
+        return EntryColumns.from_journals([self])
+
+    @property
+    def failed_entries(self) -> List[Entry]:
+        return [x for x in self.entries if x.errors]
+
+    @property
+    def directory_name(self) -> str:
+        return f"{self.year}_{replace_spaces_and_dashes(self.title)}"
 
     @property
     def n_entries(self) -> int:
@@ -252,48 +594,107 @@ class Journal:
 
 
 class User:
-    def __init__(self, username: str):
+    def __init__(
+            self,
+            username: str,
+            max_workers: int = 8,
+            refresh: bool = False,
+            strict: bool = True,
+            archive: "HtmlArchive" = None,
+            offline: bool = False,
+    ):
+        """
+        Journal URLs are discovered first (using the discovery cache unless `refresh` is
+        True), then all journal index pages are fetched concurrently with up to
+        `max_workers` threads before the journals and their entries are processed. See
+        `Entry` for `strict`, and `load_html` for `archive` and `offline`.
+        """
         self.username = username
         self._initial_url = f"https://www.trailjournals.com/{username}"
-        self.url = self._get_url()  # this is the meaningful URL with the list of journals
-        self._soup = get_soup(self.url)
-        self.journals = self._get_journals()
-
-    def _get_url(self):
-        """This is the "Other Journals" URL, which is the meaningful URL with the list of journals."""
-        soup = get_soup(self._initial_url)
-        other_journals = soup.find("li", {"class": "other-journals"})
-        url = other_journals.find("a")["href"]
-        url = format_trailjournals_url(url)
-        logger.debug(f"found other journals URL: {url}")
-        return url
+        self.strict = strict
+        self.archive = archive
+        self.offline = offline
+        self.errors: Dict[str, str] = {}
+        # journals that failed to load, by URL
+        self.journal_errors: Dict[str, str] = {}
+        self.url = self._initial_url
+        # self.url is the meaningful URL with the list of journals
+        self.url, journal_urls = extract_field(
+            self,
+            "journals",
+            lambda: discover_journals(
+                username, refresh=refresh, archive=archive, offline=offline, strict=strict, errors=self.errors,
+            ),
+            (self._initial_url, []),
+        )
+        if not offline:
+            prefetch_pages([journal_entries_url(x) for x in journal_urls], max_workers=max_workers)
+        journals = [self._load_journal(x) for x in journal_urls]
+        self.journals = [x for x in journals if x is not None]
+
+    def _load_journal(self, url: str) -> Optional[Journal]:
+        """Load one journal, isolating failures like `Journal._load_entry`."""
+        try:
+            return Journal(url, user=self, strict=self.strict, archive=self.archive, offline=self.offline)
+        except Exception as e:
+            if self.strict:
+                raise
+            logger.warning(f"failed to load journal {url}: {e!r}")
+            self.journal_errors[url] = repr(e)
+            return None
+
+    @classmethod
+    def from_archive(cls, username: str, archive: "HtmlArchive", strict: bool = False) -> "User":
+        """Build the user entirely from archived pages, without using the network."""
+        return cls(username, strict=strict, archive=archive, offline=True)
 
-    def _get_journals(self) -> List[Journal]:
-        journals = self._soup.find_all("div", {"class": "media-body"})
-        logger.info(f"found {len(journals)} journals")
-        journal_list = []
-        for journal in journals:
-            journal_url = journal.find("a", {"class": "btn-primary"})["href"]
-            journal_list.append(Journal(journal_url, user=self))
-        return journal_list[::-1]  # reverse the list so it goes from earliest to latest
+    @property
+    def failed_entries(self) -> List[Entry]:
+        return [entry for journal in self.journals for entry in journal.failed_entries]
+
+    def reprocess(self) -> bool:
+        """Reprocess every journal and entry that had errors, without using the network."""
+        return all([journal.reprocess() for journal in self.journals])
 
-    def write_all_journals_to_json(self, directory: str = None):
+    def retry_failed_entries(self) -> bool:
+        """Load the entries that failed to load again in every journal (this uses the network)."""
+        return all([journal.retry_failed_entries() for journal in self.journals])
+
+    def write_failures(self, directory: str = None) -> int:
+        """
+        Write the entries that had errors (including their HTML) as JSON to `directory`, so
+        they can be reprocessed later with `reprocess_failures`.
+        """
+        if directory is None:
+            directory = os.path.join(self._default_directory, "failures")
+        files = [
+            (os.path.join(directory, f"{failure_file_name(entry.url)}.json"), json.dumps(entry.to_failure_record(), indent=4))
+            for entry in self.failed_entries
+        ]
+        logger.info(f"writing {len(files)} failed entries to {directory}")
+        return write_files(files)
+
+    def write_all_journals_to_json(self, directory: str = None, max_workers: int = None):
         if directory is None:
             directory = self._default_directory
-        self._write_all_journals(directory=directory, method="json")
+        self._write_all_journals(directory=directory, method="json", max_workers=max_workers)
 
-    def write_all_journals_to_text(self, directory: str = None):
+    def write_all_journals_to_text(self, directory: str = None, max_workers: int = None):
         if directory is None:
             directory = self._default_directory
-        self._write_all_journals(directory=directory, method="text")
+        self._write_all_journals(directory=directory, method="text", max_workers=max_workers)
 
-    def _write_all_journals(self, directory: str, method: str):
+    def _write_all_journals(self, directory: str, method: str, max_workers: int = None):
         logger.info(f"writing all journals ({self.n_journals} total) to {method} in {directory}")
-        for i, journal in enumerate(self.journals):
-            # format the journal number with leading zeros
-            dir_name = f"{journal.year}_{replace_spaces_and_dashes(journal.title)}"
-            journal_dir = os.path.join(directory, dir_name)
-            journal._write_all_entries(directory=journal_dir, method=method)
+        files = []
+        for journal in self.journals:
+            journal_dir = os.path.join(directory, journal.directory_name)
+            files += journal._entry_files(directory=journal_dir, method=method)
+        # write every journal through a single pool so the pool stays busy across journals
+        write_files(files, max_workers=max_workers)
+
+    def to_columns(self) -> EntryColumns:
+        return EntryColumns.from_journals(self.journals)
 
     @property
     def _default_directory(self) -> str:
@@ -344,25 +745,426 @@ def get_images_from_soup(entry_body: BeautifulSoup) -> List[Image]:
     return [Image(url, caption) for url, caption in zip(image_urls, captions)]
 
 
-@lru_cache(maxsize=1000)
+def extract_field(owner: Union[Entry, "Journal", "User"], name: str, extractor: Callable, default):
+    """
+    Run a field extractor. If `owner.strict` is False, a failure is recorded in
+    `owner.errors` and `default` is returned instead of raising.
+    """
+    try:
+        return extractor()
+    except Exception as e:
+        if owner.strict:
+            raise
+        logger.warning(f"failed to extract {name} from {owner.url}: {e!r}")
+        owner.errors[name] = repr(e)
+        return default
+
+
+def release_soup(owner: Union[Entry, "Journal"]):
+    """
+    Free the owner's parse tree once its fields are extracted. BeautifulSoup trees are many
+    times the size of the HTML and full of reference cycles, so they're decomposed instead
+    of being left for the garbage collector.
+    """
+    if getattr(owner, "_soup", None) is not None:
+        owner._soup.decompose()
+    owner._soup = None
+
+
+def reprocess_failures(directory: str) -> List[Entry]:
+    """
+    Re-run the parsers over failed entries written by `User.write_failures`, without using
+    the network. Files of entries that now parse without errors are removed; the others
+    are updated with the new errors. Return all of the reprocessed entries.
+    """
+    entries = []
+    n_fixed = 0
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith(".json"):
+            continue
+        path = os.path.join(directory, name)
+        with open(path) as f:
+            record = json.load(f)
+        entry = Entry(record["url"], strict=False, html=record["html"])
+        if entry.errors:
+            write_file_atomic(path, json.dumps({**record, "errors": entry.errors}, indent=4))
+        else:
+            os.remove(path)
+            n_fixed += 1
+        entries.append(entry)
+    logger.info(f"reprocessed {len(entries)} failed entries, {n_fixed} now parse without errors")
+    return entries
+
+
+def failure_file_name(url: str) -> str:
+    name = replace_spaces_and_dashes(url.replace("https://www.trailjournals.com", "").strip("/").replace("/", "_"))
+    return "".join([x for x in name if x.isalnum() or x == "_"])
+
+
+def get_entry_urls_from_soup(soup: BeautifulSoup) -> List[str]:
+    """Extract the entry URLs from a journal's entry list page (oldest first)."""
+    table = soup.find("table")
+    return [format_trailjournals_url(x["href"]) for x in table.find_all("a")]
+
+
+def load_html(
+        url: str,
+        archive: "HtmlArchive" = None,
+        offline: bool = False,
+        refresh: bool = False,
+        cache: bool = True,
+) -> str:
+    """
+    Get a page's HTML. If `offline`, the page is read from `archive` (see `html_archive.py`)
+    and the network is never used. Otherwise the page is fetched (through the `get_html`
+    cache unless `refresh`) and, if `archive` is given, stored in the archive. Pages that
+    are only read once should be loaded with `cache=False`: a prefetched copy is taken out
+    of the cache, and otherwise the page is fetched without being cached.
+    """
+    if offline:
+        if archive is None:
+            raise ValueError("offline mode requires an archive")
+        return archive.get(url)
+    if refresh:
+        html = fetch_html(url)
+    elif not cache:
+        html = html_cache.pop((url, ())) or fetch_html(url)
+    else:
+        html = get_html(url)
+    if archive is not None:
+        archive.append(url, html)
+    return html
+
+
 def get_soup(url: str, parser: str = "html.parser", **requests_kwargs) -> BeautifulSoup:
     """Make a request to the URL and scrape the HTML."""
+    return BeautifulSoup(get_html(url, **requests_kwargs), parser)
+
+
+def memory_budget_bytes() -> int:
+    """The crawler's memory budget from MEMORY_BUDGET_MB (default 512)."""
+    return int(float(os.getenv("MEMORY_BUDGET_MB", 512)) * 1024 * 1024)
+
+
+class HtmlCache:
+    """Thread-safe LRU cache of pages, bounded by the total size of the cached HTML rather than a count."""
+    def __init__(self, max_bytes: int = None):
+        """Without `max_bytes`, the cache gets half of the memory budget, read when it's used."""
+        self._max_bytes = max_bytes
+        self.n_bytes = 0
+        self._pages: "OrderedDict[tuple, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def max_bytes(self) -> int:
+        if self._max_bytes is not None:
+            return self._max_bytes
+        # the other half leaves room for the parse tree of the page being processed (trees
+        # are released after extraction, see `release_soup`) and the extracted entries
+        return memory_budget_bytes() // 2
+
+    def get(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            html = self._pages.get(key)
+            if html is not None:
+                self._pages.move_to_end(key)
+            return html
+
+    def put(self, key: tuple, html: str):
+        size = sys.getsizeof(html)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._pages:
+                self.n_bytes -= sys.getsizeof(self._pages.pop(key))
+            self._pages[key] = html
+            self.n_bytes += size
+            while self.n_bytes > self.max_bytes:
+                _, evicted = self._pages.popitem(last=False)
+                self.n_bytes -= sys.getsizeof(evicted)
+
+    def pop(self, key: tuple) -> Optional[str]:
+        with self._lock:
+            html = self._pages.pop(key, None)
+            if html is not None:
+                self.n_bytes -= sys.getsizeof(html)
+            return html
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self.n_bytes = 0
+
+    def __len__(self):
+        return len(self._pages)
+
+
+html_cache = HtmlCache()
+
+
+def get_html(url: str, **requests_kwargs) -> str:
+    """Make a request to the URL and return the HTML. Responses are cached in `html_cache`."""
+    key = (url, tuple(sorted(requests_kwargs.items())))
+    html = html_cache.get(key)
+    if html is None:
+        html = fetch_html(url, **requests_kwargs)
+        html_cache.put(key, html)
+    return html
+
+
+_request_hooks: List[Callable[[str], None]] = []
+
+
+@contextmanager
+def before_requests(hook: Callable[[str], None]):
+    """Call `hook(url)` before every page and image request made inside the block, e.g., to rate limit them."""
+    _request_hooks.append(hook)
+    try:
+        yield
+    finally:
+        _request_hooks.remove(hook)
+
+
+def _run_request_hooks(url: str):
+    for hook in list(_request_hooks):
+        hook(url)
+
+
+def fetch_html(url: str, **requests_kwargs) -> str:
+    """Make a request to the URL and return the HTML. Unlike `get_html`, this is never cached."""
     logger.debug(f"scraping {url}")
-    r = requests.get(url, **requests_kwargs)
-    r.raise_for_status()
-    return BeautifulSoup(r.text, parser)
+    _run_request_hooks(url)
+    # streamed while profiling so the profiler can tell the first byte from the end of the body
+    stream = crawl_profiler.active() is not None
+    with crawl_profiler.track_request(url), requests.get(url, **{"stream": stream, **requests_kwargs}) as r:
+        crawl_profiler.mark(url, "first_byte", status=r.status_code)
+        r.raise_for_status()
+        html = r.text
+        crawl_profiler.mark(url, "body_done", n_bytes=len(r.content))
+    return html
+
+
+def prefetch_pages(urls: List[str], max_workers: int = 8):
+    """
+    Fetch pages concurrently so that subsequent `get_html` calls are served from its cache
+    instead of waiting on one round trip at a time. Failures are only logged here; they are
+    raised again when the page is requested for real. Prefetching stops once `html_cache`
+    is full, since pages prefetched beyond that would evict the earlier ones before they're
+    used.
+    """
+    urls = list(dict.fromkeys(format_trailjournals_url(x) for x in urls))
+    if max_workers is None or max_workers <= 1 or len(urls) <= 1:
+        return
+    logger.debug(f"prefetching {len(urls)} pages")
+    futures = {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(urls))) as executor:
+        pending = set()
+        n_bytes = html_cache.n_bytes  # pages prefetched earlier that haven't been used yet
+        for url in urls:
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                n_bytes += sum([sys.getsizeof(x.result()) for x in done if x.exception() is None])
+            if n_bytes >= html_cache.max_bytes:
+                logger.info(f"HTML cache is full, prefetched {len(futures)} of {len(urls)} pages")
+                break
+            crawl_profiler.mark(url, "queued")
+            future = executor.submit(get_html, url)
+            futures[future] = url
+            pending.add(future)
+    for future, url in futures.items():
+        if future.exception() is not None:
+            logger.warning(f"failed to prefetch {url}: {future.exception()}")
+
+
+def discover_journals(
+        username: str,
+        refresh: bool = False,
+        archive: "HtmlArchive" = None,
+        offline: bool = False,
+        strict: bool = True,
+        errors: Dict[str, str] = None,
+) -> Tuple[str, List[str]]:
+    """
+    Return the user's "Other Journals" URL (the meaningful URL with the list of journals)
+    and their journal URLs, earliest to latest. The "Other Journals" URL never changes for
+    a user, so it is always reused from the discovery cache once known. The journal list is
+    reused until it is older than DISCOVERY_CACHE_TTL seconds (or `refresh` is True). A
+    journal list with skipped journals isn't cached, so they're found once the page is fixed.
+
+    With an `archive`, the discovery cache isn't used, so that both pages always end up in
+    (or, if `offline`, are read from) the archive. See `get_journal_urls` for `strict` and
+    `errors`.
+    """
+    if archive is not None:
+        url = get_other_journals_url(username, archive=archive, offline=offline)
+        return url, get_journal_urls(url, refresh=refresh, archive=archive, offline=offline, strict=strict, errors=errors)
+
+    cache = load_discovery_cache()
+    cached = cache.get(username, {})
+    ttl = float(os.getenv("DISCOVERY_CACHE_TTL", 24 * 60 * 60))
+    url = cached.get("url")
+    if not refresh and url and time.time() - cached.get("updated", 0) < ttl:
+        logger.debug(f"using cached journal list for {username}")
+        return url, cached["journal_urls"]
+
+    skipped = {}
+    if url:
+        try:
+            journal_urls = get_journal_urls(url, refresh=refresh, strict=strict, errors=skipped)
+        except requests.HTTPError:
+            logger.debug(f"cached other journals URL failed for {username}, resolving it again")
+            url = get_other_journals_url(username)
+            journal_urls = get_journal_urls(url, refresh=refresh, strict=strict, errors=skipped)
+    else:
+        url = get_other_journals_url(username)
+        journal_urls = get_journal_urls(url, refresh=refresh, strict=strict, errors=skipped)
+
+    if errors is not None:
+        errors.update(skipped)
+    if skipped:
+        # keep only the URL, so the journal list is fetched again next time
+        cache[username] = {"url": url, "journal_urls": [], "updated": 0}
+    else:
+        cache[username] = {"url": url, "journal_urls": journal_urls, "updated": time.time()}
+    save_discovery_cache(cache)
+    return url, journal_urls
+
+
+def get_other_journals_url(username: str, archive: "HtmlArchive" = None, offline: bool = False) -> str:
+    """This is the "Other Journals" URL, which is the meaningful URL with the list of journals."""
+    html = load_html(f"https://www.trailjournals.com/{username}", archive=archive, offline=offline)
+    soup = BeautifulSoup(html, "html.parser")
+    other_journals = soup.find("li", {"class": "other-journals"})
+    url = format_trailjournals_url(other_journals.find("a")["href"])
+    soup.decompose()
+    logger.debug(f"found other journals URL: {url}")
+    return url
 
 
-def download_image(image_url: str, path: str):
+def get_journal_urls(
+        url: str,
+        refresh: bool = False,
+        archive: "HtmlArchive" = None,
+        offline: bool = False,
+        strict: bool = True,
+        errors: Dict[str, str] = None,
+) -> List[str]:
+    """
+    Get the journal URLs (earliest to latest) from the "Other Journals" page. Bypass the
+    cache if `refresh`. If `strict` is False, a journal whose link can't be found is skipped
+    instead of raising, and recorded in `errors` as "journals[<position>]".
+    """
+    soup = BeautifulSoup(load_html(url, archive=archive, offline=offline, refresh=refresh), "html.parser")
+    journals = soup.find_all("div", {"class": "media-body"})
+    logger.info(f"found {len(journals)} journals")
+    journal_urls = []
+    for i, journal in enumerate(journals):
+        try:
+            journal_urls.append(format_trailjournals_url(journal.find("a", {"class": "btn-primary"})["href"]))
+        except (AttributeError, KeyError, TypeError) as e:
+            if strict:
+                soup.decompose()
+                raise
+            logger.warning(f"skipping a journal without a link on {url}: {e!r}")
+            if errors is not None:
+                errors[f"journals[{len(journals) - 1 - i}]"] = repr(e)  # position from earliest to latest
+    soup.decompose()
+    return journal_urls[::-1]  # reverse the list so it goes from earliest to latest
+
+
+def discovery_cache_path() -> str:
+    default = os.path.join(os.getenv("OUTPUT_DIR", "./data"), ".discovery_cache.json")
+    return os.getenv("DISCOVERY_CACHE", default)
+
+
+def load_discovery_cache() -> dict:
+    """Load the cache of {username: {"url": ..., "journal_urls": [...], "updated": ...}}."""
+    try:
+        with open(discovery_cache_path()) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_discovery_cache(cache: dict):
+    path = discovery_cache_path()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    write_file_atomic(path, json.dumps(cache, indent=4))
+
+
+def get_image_data(image_url: str) -> bytes:
     logger.debug(f"downloading image from {image_url}")
-    r = requests.get(image_url)
-    r.raise_for_status()
-    image_data = r.content
+    _run_request_hooks(image_url)
+    stream = crawl_profiler.active() is not None
+    with crawl_profiler.track_request(image_url, kind="image"), requests.get(image_url, stream=stream) as r:
+        crawl_profiler.mark(image_url, "first_byte", status=r.status_code)
+        r.raise_for_status()
+        content = r.content
+        crawl_profiler.mark(image_url, "body_done", n_bytes=len(content))
+    return content
+
+
+def download_image(image_url: str, path: str):
+    image_data = get_image_data(image_url)
     logger.debug(f"writing image data to {path}")
     with open(path, "wb") as handler:
         handler.write(image_data)
 
 
+def write_file_atomic(path: str, content: Union[str, bytes]) -> bool:
+    """
+    Write content to a temporary file next to `path` and rename it into place, so readers
+    never see a partially written file. If the file already exists with the same content
+    (compared by size, then SHA-256), nothing is written. Return True if the file was written.
+    """
+    data = content.encode("utf-8") if isinstance(content, str) else content
+    try:
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if hashlib.sha256(f.read()).digest() == hashlib.sha256(data).digest():
+                    logger.debug(f"skipping unchanged file {path}")
+                    return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(path) or "."
+    tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{os.urandom(6).hex()}.tmp")
+    # created with mode 0666 so the process umask gives the file the usual permissions
+    # (unlike tempfile.mkstemp, which always uses 0600)
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0), 0o666)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def write_files(files: List[Tuple[str, Union[str, bytes]]], max_workers: int = None) -> int:
+    """
+    Write (path, content) pairs with `write_file_atomic`. If `max_workers` is greater than
+    1, the writes are handed to a thread pool of that size, which makes exports to slow
+    (e.g., network-mounted) directories bounded by throughput rather than per-file latency.
+    Return the number of files that were actually written.
+    """
+    for directory in {os.path.dirname(path) for path, _ in files}:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    if max_workers is None or max_workers <= 1:
+        results = [write_file_atomic(path, content) for path, content in files]
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda x: write_file_atomic(*x), files))
+
+    n_written = sum(results)
+    logger.info(f"wrote {n_written} files ({len(files) - n_written} unchanged)")
+    return n_written
+
+
 def format_trailjournals_url(url: str):
     if not url.startswith("https://www.trailjournals.com"):
         if not url.startswith("/"):
@@ -371,7 +1173,34 @@ def format_trailjournals_url(url: str):
     return url
 
 
+def journal_entries_url(url: str) -> str:
+    """Convert a journal URL to the URL of the page listing all of its entries."""
+    url = format_trailjournals_url(url)
+    if "journal/entries/" in url:
+        return url
+    return url.replace("journal/", "journal/entries/")
+
+
 def replace_spaces_and_dashes(s: str) -> str:
     s = s.replace(" ", "_").replace("-", "_")
     s = re.sub("_+", "_", s)  # replace repeated underscores with a single underscore
     return s
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Utilities for scraped trailjournals data.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    reprocess = subparsers.add_parser("reprocess", help="re-parse failed entries written by User.write_failures")
+    reprocess.add_argument("directory")
+    reprocess.add_argument("--output-dir", default=None, help="write the fixed entries as JSON here")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.getLevelName(os.getenv("LOGLEVEL", "INFO")))
+    if args.command == "reprocess":
+        for entry in reprocess_failures(args.directory):
+            if args.output_dir and not entry.errors:
+                entry.write_to_json(os.path.join(args.output_dir, failure_file_name(entry.url)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+"""
+Long-running watcher that polls followed users' journals and fetches only new entries.
+
+Each journal's entry list is polled on its own schedule: after a poll that finds new
+entries the interval drops back to `min_interval`, and after each poll that finds nothing
+it grows by `backoff` up to `max_interval`, so active journals are checked often and
+dormant ones rarely. Every request (including the ones made while discovering journals
+and fetching entries) goes through a per-host request budget. Seen entry URLs and
+schedules are saved to a state file, so restarting the watcher doesn't re-fetch anything.
+
+Usage:
+    python watch_journals.py bcunningham another_hiker --output-dir ./data/new_entries
+"""
+import os
+import json
+import time
+import argparse
+from dataclasses import dataclass, field, asdict
+from typing import Callable, Dict, List, Set
+from urllib.parse import urlparse
+
+from bs4 import BeautifulSoup
+
+from trailjournals_scraping import (
+    Entry,
+    before_requests,
+    discover_journals,
+    fetch_html,
+    get_entry_urls_from_soup,
+    journal_entries_url,
+    replace_spaces_and_dashes,
+    write_file_atomic,
+)
+
+import logging
+logger = logging.getLogger(__name__)
+
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def default_state_path() -> str:
+    output_dir = os.getenv("OUTPUT_DIR", "./data")
+    return os.path.join(output_dir, ".watch_state.json")
+
+
+class HostBudget:
+    """Token bucket per host: at most `requests_per_minute` requests on average, with bursts up to that many."""
+    def __init__(
+            self,
+            requests_per_minute: float,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets: Dict[str, List[float]] = {}  # host -> [tokens, last refill time]
+
+    def acquire(self, url: str):
+        host = urlparse(url).netloc
+        rate = self.requests_per_minute / 60
+        tokens, last = self._buckets.get(host, [self.requests_per_minute, self.clock()])
+        now = self.clock()
+        tokens = min(self.requests_per_minute, tokens + (now - last) * rate)
+        if tokens < 1:
+            wait = (1 - tokens) / rate
+            logger.debug(f"request budget for {host} exhausted, waiting {wait:.1f}s")
+            self.sleep(wait)
+            now += wait
+            tokens = 1
+        self._buckets[host] = [tokens - 1, now]
+
+
+@dataclass
+class WatchedJournal:
+    username: str
+    url: str  # the journal's entry list URL
+    interval: float
+    next_poll: float = 0
+    seen: Set[str] = field(default_factory=set)
+    # False until a poll has recorded the journal's existing entries as seen without emitting them
+    seeded: bool = True
+
+
+class JournalWatcher:
+    def __init__(
+            self,
+            usernames: List[str],
+            on_entry: Callable[[str, str, Entry], None] = None,
+            output_dir: str = None,
+            state_path: str = None,
+            min_interval: float = 15 * 60,
+            max_interval: float = 24 * 60 * 60,
+            backoff: float = 2.0,
+            rediscover_interval: float = 6 * 60 * 60,
+            requests_per_minute: float = 30,
+            clock: Callable[[], float] = time.time,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        New entries are passed to `on_entry(username, journal_url, entry)` (e.g., a queue's
+        `put` wrapped in a lambda) and/or written as JSON to `output_dir/<username>/`. The
+        users' journal lists are re-discovered every `rediscover_interval` seconds to pick
+        up new journals. When a user is watched for the first time, their existing entries
+        are recorded as seen without being emitted; entries of journals found later are all new.
+        """
+        self.usernames = list(usernames)
+        self.on_entry = on_entry
+        self.output_dir = output_dir
+        self.state_path = state_path or default_state_path()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rediscover_interval = rediscover_interval
+        self.budget = HostBudget(requests_per_minute, clock=clock, sleep=sleep)
+        self.clock = clock
+        self.sleep = sleep
+        self.journals: Dict[str, WatchedJournal] = {}
+        self._next_rediscover: Dict[str, float] = {}
+        self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return
+        for url, journal in state["journals"].items():
+            self.journals[url] = WatchedJournal(**{**journal, "seen": set(journal["seen"])})
+
+    def _save_state(self):
+        journals = {url: {**asdict(x), "seen": sorted(x.seen)} for url, x in self.journals.items()}
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        write_file_atomic(self.state_path, json.dumps({"journals": journals}, indent=4))
+
+    def _rediscover(self, username: str):
+        now = self.clock()
+        if now < self._next_rediscover.get(username, 0):
+            return
+        first_time = not any([x.username == username for x in self.journals.values()])
+        try:
+            _, journal_urls = discover_journals(username, refresh=True)
+        except Exception as e:
+            # parse errors included, so one bad page doesn't stop the watcher
+            logger.warning(f"failed to discover journals for {username}: {e!r}")
+            self._next_rediscover[username] = now + self.min_interval
+            return
+        self._next_rediscover[username] = now + self.rediscover_interval
+        for url in journal_urls:
+            url = journal_entries_url(url)
+            if url not in self.journals:
+                logger.info(f"watching new journal {url} for {username}")
+                journal = WatchedJournal(username=username, url=url, interval=self.min_interval, seeded=not first_time)
+                self.journals[url] = journal
+                if first_time:
+                    self._poll(journal)
+
+    def _poll(self, journal: WatchedJournal) -> int:
+        """Poll the journal's entry list. An unseeded journal's entries are only recorded as seen."""
+        emit = journal.seeded
+        try:
+            soup = BeautifulSoup(fetch_html(journal.url), "html.parser")
+            entry_urls = get_entry_urls_from_soup(soup)
+            soup.decompose()
+            journal.seeded = True
+        except Exception as e:
+            logger.warning(f"failed to poll {journal.url}: {e!r}")
+            entry_urls = []
+
+        new_urls = [x for x in entry_urls if x not in journal.seen]
+        n_new = 0
+        for url in new_urls:
+            if emit:
+                try:
+                    entry = Entry(url, strict=False)
+                except Exception as e:
+                    logger.warning(f"failed to fetch entry {url}: {e}")
+                    continue  # not marked as seen, so it is retried on the next poll
+                self._emit(journal, entry)
+                n_new += 1
+            journal.seen.add(url)
+
+        if n_new:
+            journal.interval = self.min_interval
+        else:
+            journal.interval = min(self.max_interval, journal.interval * self.backoff)
+        journal.next_poll = self.clock() + journal.interval
+        logger.debug(f"polled {journal.url}: {n_new} new entries, next poll in {journal.interval:.0f}s")
+        return n_new
+
+    def _emit(self, journal: WatchedJournal, entry: Entry):
+        logger.info(f"new entry for {journal.username}: {entry.title}")
+        if self.output_dir:
+            prefix = entry.entry_date.isoformat() if entry.entry_date else "undated"
+            name = f"{prefix}_{replace_spaces_and_dashes(entry.title or entry.url.split('/')[-1])}"
+            entry.write_to_json(os.path.join(self.output_dir, journal.username, name))
+        if self.on_entry:
+            self.on_entry(journal.username, journal.url, entry)
+
+    def poll_once(self) -> int:
+        """Poll every journal that is due and return the number of new entries."""
+        with before_requests(self.budget.acquire):
+            for username in self.usernames:
+                self._rediscover(username)
+            now = self.clock()
+            due = [x for x in self.journals.values() if x.username in self.usernames and x.next_poll <= now]
+            n_new = sum([self._poll(journal) for journal in sorted(due, key=lambda x: x.next_poll)])
+        self._save_state()
+        return n_new
+
+    def seconds_until_next_poll(self) -> float:
+        next_times = [x.next_poll for x in self.journals.values() if x.username in self.usernames]
+        next_times += [self._next_rediscover.get(x, 0) for x in self.usernames]
+        return max(0.0, min(next_times, default=self.min_interval) - self.clock())
+
+    def run(self):
+        logger.info(f"watching {len(self.usernames)} users")
+        while True:
+            self.poll_once()
+            self.sleep(max(1.0, self.seconds_until_next_poll()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch trailjournals users and fetch new entries as they're posted.")
+    parser.add_argument("usernames", nargs="+")
+    parser.add_argument("--output-dir", default=None, help="write new entries as JSON here")
+    parser.add_argument("--state", default=None, help="state file (defaults to $OUTPUT_DIR/.watch_state.json)")
+    parser.add_argument("--min-interval", type=float, default=15 * 60, help="seconds between polls of an active journal")
+    parser.add_argument("--max-interval", type=float, default=24 * 60 * 60, help="seconds between polls of a dormant journal")
+    parser.add_argument("--requests-per-minute", type=float, default=30)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.getLevelName(os.getenv("LOGLEVEL", "INFO")))
+    watcher = JournalWatcher(
+        args.usernames,
+        output_dir=args.output_dir or os.path.join(os.getenv("OUTPUT_DIR", "./data"), "new_entries"),
+        state_path=args.state,
+        min_interval=args.min_interval,
+        max_interval=args.max_interval,
+        requests_per_minute=args.requests_per_minute,
+    )
+    watcher.run()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,9 @@
 import os
-from typing import List
+import time
+from typing import Callable, Iterator, List
 
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 from google.oauth2 import service_account
 
 from trailjournals_scraping import User, Entry, Image
@@ -18,14 +20,13 @@ logging.getLogger("trailjournals_scraping").setLevel(logging.getLevelName(os.get
 DOCUMENT_ID = os.getenv("GOOGLE_DOC_ID")
 TRAILJOURNALS_USERNAME = os.getenv("TRAILJOURNALS_USERNAME")
 
-user = User(TRAILJOURNALS_USERNAME)
+# Google's default write quota is 60 requests per minute per user
+WRITES_PER_MINUTE = 60
+MAX_RETRIES = 6
 
 DEFAULT_IMAGE_HEIGHT = 360
 DEFAULT_IMAGE_WIDTH = 360
 
-SECTION_BREAK = {"insertSectionBreak": {"location": {"index": 1}, "sectionType": "NEXT_PAGE"}}
-PAGE_BREAK = {"insertSectionBreak": {"location": {"index": 1}, "sectionType": "NEXT_PAGE"}}
-
 
 def cell_border(
         width: float = 0,
@@ -105,13 +106,8 @@ def insert_text_with_style(
         start: int = 1,
 ) -> List[dict]:
     """
-    Usage:
-    ```
-    request_list += [
-        ...,  # other requests
-        *insert_text_with_style("asdf", named_style="NORMAL_TEXT"),
-    ]
-    ```
+    Return the formatting requests for the text followed by the insert request. Usually
+    called through `DocumentBuilder.insert_text`, which keeps track of `start`.
     """
     out = []
     if alignment:
@@ -124,185 +120,326 @@ def insert_text_with_style(
     return out
 
 
+def table_size(rows: int, columns: int) -> int:
+    """
+    Number of indices taken by an empty table (not counting the newline that is inserted
+    before it): one for the table start, one for each row and cell start, one for each
+    cell's empty paragraph, and one for the table end.
+    """
+    return 1 + rows * (1 + 2 * columns) + 1
+
+
+def table_cell_index(table_start: int, row: int, column: int, columns: int) -> int:
+    """Index of the (empty) paragraph in a cell of an empty table that starts at `table_start`."""
+    row_start = table_start + 1 + row * (1 + 2 * columns)
+    return row_start + 1 + 2 * column + 1
+
+
+class DocumentBuilder:
+    """
+    Build requests in document order, always inserting at the end of the document, while
+    keeping track of the running end index. Nothing already in the document is shifted by
+    later inserts, so each batch of requests is final as soon as it is flushed.
+
+    Formatting requests are held back and emitted after the inserts of each batch, in
+    reverse document order. When several paragraph styles touch the same paragraph (e.g.,
+    a heading followed by a "\n" with normal style), the earliest one wins.
+    """
+    def __init__(self, start_index: int = 1):
+        # index where the next insert goes, i.e., just before the document's final newline
+        self.index = start_index
+        self._inserts = []
+        self._formatting = []
+
+    def _advance(self, index: int, length: int):
+        if index <= self.index:
+            self.index += length
+
+    def insert_text(
+            self,
+            text: str,
+            named_style: str = "NORMAL_TEXT",
+            alignment: str = "START",
+            italic: bool = False,
+            index: int = None,
+    ):
+        """Insert text at the end of the document, or at `index` (e.g., inside a table cell)."""
+        if index is None:
+            index = self.index
+        *formatting, insert = insert_text_with_style(text, named_style, alignment, italic, start=index)
+        self._inserts.append(insert)
+        self._formatting += formatting
+        self._advance(index, len(text))
+
+    def insert_table(self, rows: int, columns: int) -> int:
+        """Insert an empty table at the end of the document and return the index where it starts."""
+        index = self.index
+        self._inserts.append({"insertTable": {"location": {"index": index}, "columns": columns, "rows": rows}})
+        self._advance(index, 1 + table_size(rows, columns))  # a newline is inserted before the table
+        return index + 1
+
+    def insert_section_break(self, section_type: str = "NEXT_PAGE"):
+        index = self.index
+        self._inserts.append({"insertSectionBreak": {"location": {"index": index}, "sectionType": section_type}})
+        self._advance(index, 2)  # a newline is inserted before the section break
+
+    def insert_inline_image(self, uri: str, height: int, width: int):
+        index = self.index
+        self._inserts.append({
+            "insertInlineImage": {
+                "location": {"index": index},
+                "uri": uri,
+                "objectSize": {
+                    "height": {"magnitude": height, "unit": "PT"},
+                    "width": {"magnitude": width, "unit": "PT"},
+                },
+            }
+        })
+        self._advance(index, 1)
+
+    def add_formatting(self, request: dict):
+        self._formatting.append(request)
+
+    def flush(self) -> List[dict]:
+        """Return the requests built since the last flush."""
+        out = self._inserts + self._formatting[::-1]
+        self._inserts = []
+        self._formatting = []
+        return out
+
+    def __len__(self):
+        return len(self._inserts) + len(self._formatting)
+
+
 def insert_hr(
+        builder: DocumentBuilder,
         width: float = 0.5,
         top_or_bottom: str = "bottom",
         red: int = 102,
         green: int = 102,
         blue: int = 102,
-) -> List[dict]:
+):
     if top_or_bottom not in ("top", "bottom"):
         raise ValueError(f"top_or_bottom must be 'top' or 'bottom', not {top_or_bottom}")
     top = width if top_or_bottom == "top" else 0
     bottom = width if top_or_bottom == "bottom" else 0
-    return [
-        {
-            "updateTableCellStyle": {
-                "fields": "borderBottom,borderLeft,borderRight,borderTop,"
-                          "paddingBottom,paddingLeft,paddingRight,paddingTop",
-                "tableStartLocation": {
-                    "index": 2,
-                },
-                "tableCellStyle": {
-                    **apply_padding(),
-                    **apply_border(top=top, bottom=bottom, red=red, green=green, blue=blue),
-                },
+    table_start = builder.insert_table(rows=1, columns=1)
+    builder.add_formatting({
+        "updateTableCellStyle": {
+            "fields": "borderBottom,borderLeft,borderRight,borderTop,"
+                      "paddingBottom,paddingLeft,paddingRight,paddingTop",
+            "tableStartLocation": {
+                "index": table_start,
+            },
+            "tableCellStyle": {
+                **apply_padding(),
+                **apply_border(top=top, bottom=bottom, red=red, green=green, blue=blue),
             },
         },
-        {"insertTable": {"location": {"index": 1}, "columns": 1, "rows": 1}},
-    ]
+    })
 
 
-def process_entry_metadata(entry: Entry) -> List[dict]:
-    return [
-        # not really sure how the index values are supposed to work with tables, but it
-        # seems you add 2 to go to the next column, add 5 to go to the next row
-        *insert_text_with_style(
-            text=f"Start: {entry.metadata.start}",
-            named_style="SUBTITLE",
-            alignment="START",
-            start=5
-        ),
-        *insert_text_with_style(
-            text=f"Miles: {entry.metadata.miles}",
-            named_style="SUBTITLE",
-            alignment="END",
-            start=7
-        ),
-        *insert_text_with_style(
-            text=f"Destination: {entry.metadata.destination}",
-            named_style="SUBTITLE",
-            alignment="START",
-            start=10
-        ),
-        *insert_text_with_style(
-            text=f"Trip miles: {entry.metadata.trip_miles}",
-            named_style="SUBTITLE",
-            alignment="END",
-            start=12
-        ),
-        {
-            "updateTableCellStyle": {
-                "fields": "borderBottom,borderLeft,borderRight,borderTop,"
-                          "paddingBottom,paddingLeft,paddingRight,paddingTop,"
-                          "contentAlignment",
-                "tableStartLocation": {
-                    "index": 2,
-                },
-                "tableCellStyle": {
-                    **apply_border(),
-                    **apply_padding(),
-                    "contentAlignment": "MIDDLE",
-                },
+def process_entry_metadata(builder: DocumentBuilder, entry: Entry):
+    table_start = builder.insert_table(rows=2, columns=2)
+    cells = [
+        (0, 0, f"Start: {entry.metadata.start}", "START"),
+        (0, 1, f"Miles: {entry.metadata.miles}", "END"),
+        (1, 0, f"Destination: {entry.metadata.destination}", "START"),
+        (1, 1, f"Trip miles: {entry.metadata.trip_miles}", "END"),
+    ]
+    # fill the cells in order, so each cell's index is shifted by the text already inserted before it
+    offset = 0
+    for row, column, text, alignment in cells:
+        index = table_cell_index(table_start, row, column, columns=2) + offset
+        builder.insert_text(text, named_style="SUBTITLE", alignment=alignment, index=index)
+        offset += len(text)
+
+    builder.add_formatting({
+        "updateTableCellStyle": {
+            "fields": "borderBottom,borderLeft,borderRight,borderTop,"
+                      "paddingBottom,paddingLeft,paddingRight,paddingTop,"
+                      "contentAlignment",
+            "tableStartLocation": {
+                "index": table_start,
             },
-        },
-        {
-            "updateTableColumnProperties": {
-                "tableStartLocation": {"index": 2},
-                "columnIndices": [1],
-                "tableColumnProperties": {
-                    "widthType": "FIXED_WIDTH",
-                    "width": {
-                        "magnitude": 110,
-                        "unit": "PT"
-                    }
-                },
-                "fields": "*"
+            "tableCellStyle": {
+                **apply_border(),
+                **apply_padding(),
+                "contentAlignment": "MIDDLE",
             },
         },
-        {
+    })
+    for column, width in [(0, 280), (1, 110)]:
+        builder.add_formatting({
             "updateTableColumnProperties": {
-                "tableStartLocation": {"index": 2},
-                "columnIndices": [0],
+                "tableStartLocation": {"index": table_start},
+                "columnIndices": [column],
                 "tableColumnProperties": {
                     "widthType": "FIXED_WIDTH",
                     "width": {
-                        "magnitude": 280,
+                        "magnitude": width,
                         "unit": "PT"
                     }
                 },
                 "fields": "*"
             },
-        },
-        {"insertTable": {"location": {"index": 1}, "columns": 2, "rows": 2}},
-        format_paragraph_alignment("CENTER", start=1, end=1),
-        *insert_hr(top_or_bottom="top"),
-    ]
+        })
+    # center the paragraph between the metadata table and the rule below it
+    builder.add_formatting(format_paragraph_alignment("CENTER", start=builder.index, end=builder.index))
+    insert_hr(builder, top_or_bottom="top")
 
 
 def insert_image(
+        builder: DocumentBuilder,
         image: Image,
         height: int = DEFAULT_IMAGE_HEIGHT,
         width: int = DEFAULT_IMAGE_WIDTH,
-) -> List[dict]:
-    out = [
-        format_paragraph_alignment("CENTER"),
-        {
-            "insertInlineImage": {
-                "location": {"index": 1},
-                "uri": image.url,
-                "objectSize": {
-                    "height": {"magnitude": height, "unit": "PT"},
-                    "width": {"magnitude": width, "unit": "PT"},
-                },
-            }
-        },
-    ]
+):
+    builder.add_formatting(format_paragraph_alignment("CENTER", start=builder.index, end=builder.index))
+    builder.insert_inline_image(image.url, height=height, width=width)
     if image.caption:
-        out += [
-            *insert_text_with_style("\n"),
-            *insert_text_with_style(image.caption, named_style="SUBTITLE", alignment="CENTER", italic=True),
-        ]
-    out += insert_text_with_style("\n\n")
-    return out
-
-
-request_list = []
-# request_list += [
-#     *insert_text_with_style(f"Trailjournals for {user.username}", "TITLE"),
-#     # format_named_style_type("TITLE"),
-#     # {"insertText": {"location": {"index": 1}, "text": user_title}},
-# ]
-for i, journal in enumerate(user.journals):
-    if i > 0:
-        request_list.append(SECTION_BREAK)
-    request_list += insert_text_with_style(journal.title, named_style="HEADING_1", alignment="CENTER")
-    for entry in journal.entries:
-        request_list += [
-            PAGE_BREAK,
-            *insert_text_with_style(entry.title, named_style="HEADING_2", alignment="CENTER"),
-            *insert_text_with_style("\n", alignment="CENTER"),
-            *insert_text_with_style(entry.date, named_style="SUBTITLE", alignment="CENTER"),
-            *insert_hr(),
-        ]
-        has_metadata = any([entry.metadata.start, entry.metadata.destination, entry.metadata.miles, entry.metadata.trip_miles])
-        if has_metadata:
-            request_list += process_entry_metadata(entry)
-        else:
-            request_list += insert_text_with_style("\n")
-
-        # put the first image before the content
-        if entry.images:
-            request_list += insert_image(entry.images[0])
-        else:
-            request_list += insert_text_with_style("\n")
-
-        # entry content
-        request_list += [*insert_text_with_style(entry.text, alignment="JUSTIFIED")]
-
-        # put the rest of the images after the content
-        for image in entry.images[1:]:
-            request_list += insert_text_with_style("\n\n")
-            request_list += insert_image(image)
-
-# following the best practices of the API, i.e., writing backwards so the formatting works correctly
-request_list = request_list[::-1]
-
-creds_file = os.getenv("GOOGLE_DOC_CREDENTIALS_FILE")
-credentials = service_account.Credentials.from_service_account_file(creds_file)
-
-with build("docs", "v1", credentials=credentials) as service:
-    document = service.documents().get(documentId=DOCUMENT_ID).execute()
-    logger.info(f"Loaded document: {document.get('title')}")
-    logger.info(f"Processing {len(request_list)} requests")
-    result = service.documents().batchUpdate(documentId=DOCUMENT_ID, body={"requests": request_list}).execute()
+        builder.insert_text("\n")
+        builder.insert_text(image.caption, named_style="SUBTITLE", alignment="CENTER", italic=True)
+    builder.insert_text("\n\n")
+
+
+def add_entry(builder: DocumentBuilder, entry: Entry):
+    builder.insert_section_break()
+    builder.insert_text(entry.title, named_style="HEADING_2", alignment="CENTER")
+    builder.insert_text("\n", alignment="CENTER")
+    builder.insert_text(entry.date, named_style="SUBTITLE", alignment="CENTER")
+    insert_hr(builder)
+    if entry.metadata:
+        process_entry_metadata(builder, entry)
+    else:
+        builder.insert_text("\n")
+
+    # put the first image before the content
+    if entry.images:
+        insert_image(builder, entry.images[0])
+    else:
+        builder.insert_text("\n")
+
+    # entry content
+    builder.insert_text(entry.text, alignment="JUSTIFIED")
+
+    # put the rest of the images after the content
+    for image in entry.images[1:]:
+        builder.insert_text("\n\n")
+        insert_image(builder, image)
+
+
+def iter_request_batches(user: User, start_index: int = 1, entries_per_batch: int = None) -> Iterator[List[dict]]:
+    """
+    Yield batches of requests that append the user's journals to a document whose final
+    newline is at `start_index`. With `entries_per_batch`, a batch is yielded every that
+    many entries (batches always end on an entry boundary), otherwise everything is yielded
+    as a single batch.
+    """
+    builder = DocumentBuilder(start_index=start_index)
+    n_entries = 0
+    # builder.insert_text(f"Trailjournals for {user.username}", named_style="TITLE")
+    for i, journal in enumerate(user.journals):
+        if i > 0:
+            builder.insert_section_break()
+        builder.insert_text(journal.title, named_style="HEADING_1", alignment="CENTER")
+        for entry in journal.entries:
+            add_entry(builder, entry)
+            n_entries += 1
+            if entries_per_batch and n_entries % entries_per_batch == 0:
+                yield builder.flush()
+    if len(builder):
+        yield builder.flush()
+
+
+def build_request_list(user: User, start_index: int = 1) -> List[dict]:
+    return [request for batch in iter_request_batches(user, start_index=start_index) for request in batch]
+
+
+class WritePacer:
+    """Keeps batchUpdates under `writes_per_minute` in any 60 second window, like the Docs API quota."""
+    def __init__(
+            self,
+            writes_per_minute: int = WRITES_PER_MINUTE,
+            clock: Callable[[], float] = time.monotonic,
+            sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.writes_per_minute = writes_per_minute
+        self.clock = clock
+        self.sleep = sleep
+        self._sent: List[float] = []
+
+    def wait(self):
+        now = self.clock()
+        self._sent = [x for x in self._sent if now - x < 60]
+        if len(self._sent) >= self.writes_per_minute:
+            delay = self._sent[0] + 60 - now
+            logger.info(f"write quota reached, waiting {delay:.1f}s")
+            self.sleep(delay)
+            now += delay
+            self._sent = self._sent[1:]
+        self._sent.append(now)
+
+
+def execute_with_retries(call, sleep: Callable[[float], None] = time.sleep, max_retries: int = MAX_RETRIES) -> dict:
+    """Execute an API request, retrying "quota exceeded" (429) errors with exponential backoff."""
+    for attempt in range(max_retries + 1):
+        try:
+            return call.execute()
+        except HttpError as e:
+            if e.resp.status != 429 or attempt == max_retries:
+                raise
+            delay = 2 ** attempt
+            logger.warning(f"quota exceeded, retrying in {delay}s")
+            sleep(delay)
+
+
+def write_to_google_doc(
+        user: User,
+        document_id: str,
+        credentials=None,
+        build_service=build,
+        entries_per_batch: int = None,
+        writes_per_minute: int = None,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+) -> List[dict]:
+    """
+    Append the user's journals to the end of the document, sending one batchUpdate per
+    `entries_per_batch` entries (or a single one if None). Batches are paced to stay under
+    `writes_per_minute` (default `$GOOGLE_DOC_WRITES_PER_MINUTE`, or Google's default quota
+    of 60), and batches rejected with 429 are retried with backoff. `build_service` can be
+    replaced with anything that has the signature of `googleapiclient.discovery.build`,
+    e.g., `fake_google_docs.build`. Return the batchUpdate responses.
+    """
+    if writes_per_minute is None:
+        writes_per_minute = int(os.getenv("GOOGLE_DOC_WRITES_PER_MINUTE", WRITES_PER_MINUTE))
+    pacer = WritePacer(writes_per_minute, clock=clock, sleep=sleep)
+    with build_service("docs", "v1", credentials=credentials) as service:
+        document = execute_with_retries(service.documents().get(documentId=document_id), sleep=sleep)
+        logger.info(f"Loaded document: {document.get('title')}")
+        start_index = document["body"]["content"][-1]["endIndex"] - 1
+        results = []
+        for batch in iter_request_batches(user, start_index=start_index, entries_per_batch=entries_per_batch):
+            logger.info(f"Processing {len(batch)} requests")
+            pacer.wait()
+            call = service.documents().batchUpdate(documentId=document_id, body={"requests": batch})
+            results.append(execute_with_retries(call, sleep=sleep))
+        return results
+
+
+def main():
+    user = User(TRAILJOURNALS_USERNAME)
+    creds_file = os.getenv("GOOGLE_DOC_CREDENTIALS_FILE")
+    credentials = service_account.Credentials.from_service_account_file(creds_file)
+    entries_per_batch = os.getenv("GOOGLE_DOC_ENTRIES_PER_BATCH")
+    write_to_google_doc(
+        user,
+        DOCUMENT_ID,
+        credentials=credentials,
+        entries_per_batch=int(entries_per_batch) if entries_per_batch else None,
+    )
+
+
+if __name__ == "__main__":
+    main()